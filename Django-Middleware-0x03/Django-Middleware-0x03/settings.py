@@ -50,6 +50,7 @@ AUTH_USER_MODEL = 'chats.User'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'chats.middleware.QueryInstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +67,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Fraction of requests whose SQL queries QueryInstrumentationMiddleware
+# records; lower it in production
+QUERY_INSTRUMENTATION_SAMPLE_RATE = 1.0
+
 ROOT_URLCONF = 'Django-Middleware-0x03.urls'
 
 TEMPLATES = [
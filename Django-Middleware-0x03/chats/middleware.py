@@ -92,3 +92,198 @@ class OffensiveLanguageMiddleware:
         else:
             ip = request.META.get('REMOTE_ADDR')
         return ip
+
+import logging
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('chats.queries')
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Normalize a statement so that queries differing only in their
+    values (literals, IN list lengths) share one fingerprint."""
+    sql = sql.replace('%s', '?')
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('(...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+class QueryHistograms:
+    """Per-view histograms of request time, DB time and query counts"""
+
+    DURATION_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+    QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, float('inf'))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, stats):
+        with self.lock:
+            entry = self.views.get(view)
+            if entry is None:
+                entry = self.views[view] = {
+                    'requests': 0,
+                    'queries': 0,
+                    'db_ms': 0.0,
+                    'duration_ms': [0] * len(self.DURATION_BUCKETS_MS),
+                    'db_duration_ms': [0] * len(self.DURATION_BUCKETS_MS),
+                    'query_count': [0] * len(self.QUERY_BUCKETS),
+                    'slowest': None,
+                }
+            entry['requests'] += 1
+            entry['queries'] += stats['queries']
+            entry['db_ms'] += stats['db_ms']
+            entry['duration_ms'][bisect_left(self.DURATION_BUCKETS_MS, stats['duration_ms'])] += 1
+            entry['db_duration_ms'][bisect_left(self.DURATION_BUCKETS_MS, stats['db_ms'])] += 1
+            entry['query_count'][bisect_left(self.QUERY_BUCKETS, stats['queries'])] += 1
+            slowest = stats['slowest']
+            if slowest and (entry['slowest'] is None or slowest['ms'] > entry['slowest']['ms']):
+                entry['slowest'] = slowest
+
+    def snapshot(self):
+        """Copy of the histograms keyed by view, with bucket upper bounds"""
+        def buckets(bounds, counts):
+            return {('+Inf' if bound == float('inf') else str(bound)): count
+                    for bound, count in zip(bounds, counts)}
+
+        with self.lock:
+            return {
+                view: {
+                    'requests': entry['requests'],
+                    'queries': entry['queries'],
+                    'db_ms': round(entry['db_ms'], 3),
+                    'duration_ms': buckets(self.DURATION_BUCKETS_MS, entry['duration_ms']),
+                    'db_duration_ms': buckets(self.DURATION_BUCKETS_MS, entry['db_duration_ms']),
+                    'query_count': buckets(self.QUERY_BUCKETS, entry['query_count']),
+                    'slowest': dict(entry['slowest']) if entry['slowest'] else None,
+                }
+                for view, entry in self.views.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+
+query_histograms = QueryHistograms()
+
+
+class QueryRecorder:
+    """execute_wrapper that times every statement of one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.slowest = (0.0, '')
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.total += elapsed
+            # ORM statements arrive with placeholders, so the raw text is
+            # a cheap grouping key; fingerprints are only computed below
+            self.templates[sql] += 1
+            if elapsed > self.slowest[0]:
+                self.slowest = (elapsed, sql)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the number of SQL queries, the total DB time and the slowest
+    statement of each request. The results are added to a Server-Timing
+    header, kept on request.query_stats and aggregated per view in
+    query_histograms. Statements repeated QUERY_INSTRUMENTATION_REPEAT_THRESHOLD
+    times in one request (a likely N+1) are logged as warnings.
+
+    Only a QUERY_INSTRUMENTATION_SAMPLE_RATE fraction of requests is
+    instrumented (default: all of them); the others only get their total
+    time in Server-Timing, so a low rate is cheap enough for production.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_INSTRUMENTATION_SAMPLE_RATE', 1.0)
+        self.repeat_threshold = getattr(settings, 'QUERY_INSTRUMENTATION_REPEAT_THRESHOLD', 10)
+        self.server_timing = getattr(settings, 'QUERY_INSTRUMENTATION_SERVER_TIMING', True)
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            self.add_server_timing(response, [('total', (time.perf_counter() - start) * 1000, None)])
+            return response
+
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        db_ms = recorder.total * 1000
+        slowest_ms, slowest_sql = recorder.slowest
+        stats = {
+            'queries': recorder.count,
+            'db_ms': db_ms,
+            'duration_ms': duration_ms,
+            'slowest': {
+                'ms': round(slowest_ms * 1000, 3),
+                'fingerprint': fingerprint(slowest_sql),
+            } if recorder.count else None,
+        }
+        request.query_stats = stats
+
+        view = self.view_name(request)
+        query_histograms.observe(view, stats)
+        if recorder.count:
+            sql, repeats = recorder.templates.most_common(1)[0]
+            if repeats >= self.repeat_threshold:
+                logger.warning(
+                    "%s ran the same query %d times (%d queries in total): %s",
+                    view, repeats, recorder.count, fingerprint(sql)
+                )
+
+        self.add_server_timing(response, [
+            ('db', db_ms, f'{recorder.count} queries'),
+            ('app', duration_ms - db_ms, None),
+            ('total', duration_ms, None),
+        ])
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        return match.view_name or match._func_path
+
+    def add_server_timing(self, response, metrics):
+        if not self.server_timing:
+            return
+        entries = []
+        for name, duration, description in metrics:
+            entry = f'{name};dur={duration:.1f}'
+            if description:
+                entry += f';desc="{description}"'
+            entries.append(entry)
+        existing = response.get('Server-Timing')
+        response['Server-Timing'] = ', '.join(([existing] if existing else []) + entries)
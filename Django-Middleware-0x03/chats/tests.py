@@ -1,3 +1,53 @@
-from django.test import TestCase
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 
-# Create your tests here.
+from .middleware import QueryInstrumentationMiddleware, fingerprint, query_histograms
+
+
+def view_running(queries):
+    """get_response that runs the given number of queries"""
+    def get_response(request):
+        with connection.cursor() as cursor:
+            for i in range(queries):
+                cursor.execute("SELECT %s, 'literal'", [i])
+        return HttpResponse('ok')
+    return get_response
+
+
+class QueryInstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        query_histograms.reset()
+        self.request = RequestFactory().get('/chats/')
+
+    def test_records_queries_and_server_timing(self):
+        response = QueryInstrumentationMiddleware(view_running(3))(self.request)
+        stats = self.request.query_stats
+        self.assertEqual(stats['queries'], 3)
+        self.assertEqual(stats['slowest']['fingerprint'], 'SELECT ?, ?')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+
+        histogram = query_histograms.snapshot()['unresolved']
+        self.assertEqual((histogram['requests'], histogram['queries']), (1, 3))
+        self.assertEqual(histogram['query_count']['5'], 1)
+        self.assertEqual(sum(histogram['duration_ms'].values()), 1)
+
+    @override_settings(QUERY_INSTRUMENTATION_REPEAT_THRESHOLD=5)
+    def test_logs_repeated_queries(self):
+        with self.assertLogs('chats.queries', 'WARNING') as logs:
+            QueryInstrumentationMiddleware(view_running(6))(self.request)
+        self.assertIn('same query 6 times', logs.output[0])
+
+    @override_settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_instrumented(self):
+        response = QueryInstrumentationMiddleware(view_running(2))(self.request)
+        self.assertFalse(hasattr(self.request, 'query_stats'))
+        self.assertTrue(response['Server-Timing'].startswith('total;dur='))
+        self.assertEqual(query_histograms.snapshot(), {})
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x''y'\n LIMIT 21"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?'
+        )
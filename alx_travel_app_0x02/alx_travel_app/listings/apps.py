@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ListingsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'listings'
+
+    def ready(self):
+        import listings.signals
+        from django.db.models.signals import post_migrate
+        from listings.search import ensure_search_index
+        post_migrate.connect(ensure_search_index, sender=self)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""In-process interval index for listing availability checks.
+
+Each listing gets a calendar holding the start and end dates of its active
+bookings in two sorted lists. A range [check_in, check_out) overlaps every
+booking that starts before check_out, minus those that end on or before
+check_in, so both "is it free" and "how many conflicts" are two bisections.
+
+Calendars are loaded on first use with a single query, kept current by the
+Booking signal handlers in signals.py and reloaded after
+AVAILABILITY_INDEX_TTL seconds so writes made by other processes, or through
+queryset.update(), are eventually picked up. Every write bumps its listing's
+generation, and a calendar loaded while its generation moved is read again
+rather than installed, since the load may predate the write.
+"""
+
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from .models import Listing, Booking
+
+ACTIVE_STATUSES = ('confirmed', 'pending')
+
+
+def lock_row(queryset):
+    """Lock the single row of queryset until the current transaction ends
+    and return it (DoesNotExist if absent).
+    """
+    if connection.features.has_select_for_update:
+        return queryset.select_for_update().get()
+    # SQLite has no row locks: a no-op UPDATE as the first statement of the
+    # transaction takes the database write lock instead
+    queryset.update(id=F('id'))
+    return queryset.get()
+
+
+def lock_listing_calendar(listing_id):
+    """Lock a listing against concurrent bookings until the current
+    transaction ends, returning the listing (Listing.DoesNotExist if absent).
+    """
+    return lock_row(Listing.objects.filter(pk=listing_id))
+
+
+def lock_booking(booking_id):
+    """Lock a booking against concurrent status changes until the current
+    transaction ends, returning it freshly read.
+    """
+    return lock_row(Booking.objects.filter(pk=booking_id))
+
+
+def overlapping_bookings(listing_id, check_in, check_out):
+    """Active bookings of a listing overlapping [check_in, check_out)"""
+    return Booking.objects.filter(
+        listing_id=listing_id,
+        status__in=ACTIVE_STATUSES,
+        check_in_date__lt=check_out,
+        check_out_date__gt=check_in,
+    )
+
+
+class ListingCalendar:
+    """Sorted booking intervals of a single listing"""
+
+    def __init__(self, bookings=()):
+        self.spans = {}
+        self.starts = []
+        self.ends = []
+        self.loaded_at = time.monotonic()
+        for pk, check_in, check_out in bookings:
+            self.add(pk, check_in, check_out)
+
+    def add(self, pk, check_in, check_out):
+        self.remove(pk)
+        self.spans[pk] = (check_in, check_out)
+        insort(self.starts, check_in)
+        insort(self.ends, check_out)
+
+    def remove(self, pk):
+        span = self.spans.pop(pk, None)
+        if span is not None:
+            del self.starts[bisect_left(self.starts, span[0])]
+            del self.ends[bisect_left(self.ends, span[1])]
+
+    def conflicts(self, check_in, check_out):
+        """Number of bookings overlapping [check_in, check_out)"""
+        return bisect_left(self.starts, check_out) - bisect_right(self.ends, check_in)
+
+
+class AvailabilityIndex:
+    """LRU of listing calendars shared by all requests of a process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calendars = OrderedDict()
+        self._owners = {}
+        self._generations = {}  # listing id -> writes applied so far
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AVAILABILITY_INDEX_TTL', 300)
+
+    @property
+    def max_listings(self):
+        return getattr(settings, 'AVAILABILITY_INDEX_SIZE', 10000)
+
+    def conflicts(self, listing_id, check_in, check_out):
+        """Count active bookings of a listing overlapping the given range"""
+        return self._calendar(listing_id).conflicts(check_in, check_out)
+
+    def is_available(self, listing_id, check_in, check_out):
+        return self.conflicts(listing_id, check_in, check_out) == 0
+
+    def _calendar(self, listing_id, attempts=3):
+        with self._lock:
+            calendar = self._calendars.get(listing_id)
+            if calendar is not None and time.monotonic() - calendar.loaded_at < self.ttl:
+                self._calendars.move_to_end(listing_id)
+                return calendar
+
+        for _ in range(attempts):
+            with self._lock:
+                generation = self._generations.get(listing_id, 0)
+            # Cold or expired: read the listing's active bookings from the database
+            rows = Booking.objects.filter(
+                listing_id=listing_id, status__in=ACTIVE_STATUSES
+            ).values_list('pk', 'check_in_date', 'check_out_date')
+            calendar = ListingCalendar(rows)
+            with self._lock:
+                if self._generations.get(listing_id, 0) == generation:
+                    self._install(listing_id, calendar)
+                    return calendar
+        # Still being written to: answer from the latest read, uncached
+        return calendar
+
+    def _install(self, listing_id, calendar):
+        # Called with self._lock held
+        self._discard(listing_id)
+        self._calendars[listing_id] = calendar
+        for pk in calendar.spans:
+            self._owners[pk] = listing_id
+        while len(self._calendars) > self.max_listings:
+            self._discard(next(iter(self._calendars)))
+
+    def _discard(self, listing_id):
+        calendar = self._calendars.pop(listing_id, None)
+        if calendar is not None:
+            for pk in calendar.spans:
+                self._owners.pop(pk, None)
+
+    def _bump(self, *listing_ids):
+        for listing_id in listing_ids:
+            if listing_id is not None:
+                self._generations[listing_id] = self._generations.get(listing_id, 0) + 1
+
+    def booking_saved(self, pk, listing_id, status, check_in, check_out, previous_listing_id=None):
+        """Apply a saved booking to the calendar of its listing, if loaded"""
+        with self._lock:
+            self._bump(listing_id, previous_listing_id, self._owners.get(pk))
+            self._remove(pk)
+            calendar = self._calendars.get(listing_id)
+            if calendar is not None and status in ACTIVE_STATUSES:
+                calendar.add(pk, check_in, check_out)
+                self._owners[pk] = listing_id
+
+    def booking_deleted(self, pk, listing_id=None):
+        with self._lock:
+            self._bump(listing_id, self._owners.get(pk))
+            self._remove(pk)
+
+    def listing_deleted(self, listing_id):
+        with self._lock:
+            self._bump(listing_id)
+            self._discard(listing_id)
+
+    def _remove(self, pk):
+        listing_id = self._owners.pop(pk, None)
+        calendar = self._calendars.get(listing_id)
+        if calendar is not None:
+            calendar.remove(pk)
+
+    def clear(self):
+        with self._lock:
+            self._calendars.clear()
+            self._owners.clear()
+            self._generations.clear()
+
+
+availability_index = AvailabilityIndex()
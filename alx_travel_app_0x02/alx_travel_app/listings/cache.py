@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Response cache for anonymous listing list and detail requests.
+
+Cached responses are keyed on the normalized query string and a version
+number: one version shared by every list page, and one per listing for its
+detail page. Listing and Booking signal handlers bump the versions when a
+listing, or one of its bookings, is written, so entries that could show
+stale data are never looked up again and simply expire.
+
+Version keys expire some time after the entries stored under them, so
+requests for arbitrary listing ids cannot fill the cache with keys that
+never go away, and detail requests for a pk that is not an integer are
+not cached at all. get_version and bump_version take the timeout of the
+entries (default: the response timeout), so other versioned families,
+like the quotes in pricing.py, keep their versions as long as their
+entries. A version recreated after expiry starts from the
+clock, so it never matches an older entry.
+
+Versions and counters live in the cache itself, so deployments running
+several workers need a shared backend (Redis, Memcached) for invalidation
+to reach every worker.
+
+Settings:
+    LISTING_CACHE_ALIAS    cache to use (default: 'default')
+    LISTING_CACHE_TIMEOUT  seconds to keep a response; 0 disables caching
+"""
+
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+PREFIX = 'listings:response'
+LIST_VERSION_KEY = f'{PREFIX}:version:list'
+HITS_KEY = f'{PREFIX}:hits'
+MISSES_KEY = f'{PREFIX}:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'LISTING_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'LISTING_CACHE_TIMEOUT', 300)
+
+
+def version_timeout(timeout=None):
+    # Outlives every entry stored under the version for timeout seconds
+    # (default: the response timeout)
+    return 2 * (get_timeout() if timeout is None else timeout) + 60
+
+
+def listing_version_key(pk):
+    return f'{PREFIX}:version:{pk}'
+
+
+def get_version(key, timeout=None):
+    """Current version of a family of entries kept for timeout seconds"""
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so an evicted version never repeats an old one
+        cache.add(key, time.time_ns(), timeout=version_timeout(timeout))
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key, timeout=None):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=version_timeout(timeout))
+
+
+def bump_listing(pk):
+    """Invalidate every cached list page and the detail page of a listing"""
+    bump_version(LIST_VERSION_KEY)
+    bump_version(listing_version_key(pk))
+
+
+def normalized_query(request):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+        if value != ''
+    )
+    return hashlib.sha1(urlencode(params).encode()).hexdigest()
+
+
+def list_key(request):
+    return f'{PREFIX}:list:{get_version(LIST_VERSION_KEY)}:{normalized_query(request)}'
+
+
+def detail_key(request, pk):
+    """Cache key of a detail page, or None for a pk that is not an id"""
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    version = get_version(listing_version_key(pk))
+    return f'{PREFIX}:detail:{pk}:{version}:{normalized_query(request)}'
+
+
+def count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def cached_response(request, make_key, build_response):
+    """Serve an anonymous GET from the cache, or build and store it"""
+    timeout = get_timeout()
+    if not timeout or request.method != 'GET' or request.user.is_authenticated:
+        return build_response()
+
+    cache = get_cache()
+    key = make_key()
+    if key is None:
+        return build_response()
+    cached = cache.get(key)
+    if cached is not None:
+        count(HITS_KEY)
+        response = Response(cached)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    count(MISSES_KEY)
+    response = build_response()
+    if response.status_code == 200:
+        cache.set(key, response.data, timeout)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
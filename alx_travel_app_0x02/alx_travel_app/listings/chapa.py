@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""HTTP clients for the Chapa payment gateway.
+
+ChapaClient keeps a pooled keep-alive requests session, so payment calls
+reuse open TLS connections instead of paying a handshake each time, and
+every call is bounded by connect and read timeouts. AsyncChapaClient has
+the same interface on httpx for code running on an event loop (ASGI
+views, the payment workers).
+
+Failed connections are retried with exponential backoff for every call,
+since nothing reached Chapa. Read timeouts and 429/5xx responses are only
+retried for verification, which is a GET: retrying an initialization that
+Chapa may already have processed would reuse its tx_ref.
+
+Settings:
+    CHAPA_SECRET_KEY   API secret key
+    CHAPA_BASE_URL     API root (default: 'https://api.chapa.co/v1')
+    CHAPA_TIMEOUT      seconds, or a (connect, read) pair (default: (3.05, 10))
+    CHAPA_MAX_RETRIES  retries per call (default: 3)
+    CHAPA_BACKOFF      backoff factor in seconds (default: 0.5)
+    CHAPA_POOL_SIZE    keep-alive connections per client (default: 10)
+"""
+
+import asyncio
+import threading
+from urllib.parse import quote
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_BASE_URL = 'https://api.chapa.co/v1'
+DEFAULT_TIMEOUT = (3.05, 10)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({'GET'})
+INITIALIZE_PATH = 'transaction/initialize'
+
+
+class ChapaError(Exception):
+    """A Chapa call failed; status_code is None when Chapa was unreachable"""
+
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.payload = payload or {}
+
+    @property
+    def unavailable(self):
+        return self.status_code is None or self.status_code >= 500
+
+
+def get_config(**overrides):
+    config = {
+        'secret_key': getattr(settings, 'CHAPA_SECRET_KEY', None),
+        'base_url': getattr(settings, 'CHAPA_BASE_URL', DEFAULT_BASE_URL),
+        'timeout': getattr(settings, 'CHAPA_TIMEOUT', DEFAULT_TIMEOUT),
+        'max_retries': getattr(settings, 'CHAPA_MAX_RETRIES', 3),
+        'backoff': getattr(settings, 'CHAPA_BACKOFF', 0.5),
+        'pool_size': getattr(settings, 'CHAPA_POOL_SIZE', 10),
+    }
+    config.update((key, value) for key, value in overrides.items() if value is not None)
+    if not isinstance(config['timeout'], (tuple, list)):
+        config['timeout'] = (config['timeout'], config['timeout'])
+    config['base_url'] = config['base_url'].rstrip('/') + '/'
+    return config
+
+
+def verify_path(tx_ref):
+    return f"transaction/verify/{quote(str(tx_ref), safe='')}"
+
+
+def backoff_delay(backoff, retry):
+    """Seconds to wait before the given retry (1-based)"""
+    return backoff * (2 ** (retry - 1))
+
+
+def parse_response(status_code, read_json):
+    """Return the `data` of a successful Chapa response or raise ChapaError"""
+    try:
+        payload = read_json()
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    if status_code != 200 or payload.get('status') == 'failed':
+        message = payload.get('message') or f'Chapa responded with HTTP {status_code}'
+        raise ChapaError(str(message), status_code, payload)
+    return payload.get('data') or {}
+
+
+class ChapaClient:
+    """Thread-safe blocking client sharing one connection pool"""
+
+    def __init__(self, **overrides):
+        config = get_config(**overrides)
+        self.base_url = config['base_url']
+        self.timeout = tuple(config['timeout'])
+        retry = Retry(
+            total=config['max_retries'],
+            backoff_factor=config['backoff'],
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=config['pool_size'],
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Authorization'] = f"Bearer {config['secret_key']}"
+
+    def request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(
+                method, self.base_url + path, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException as exc:
+            raise ChapaError(f'Chapa is unreachable: {exc}') from exc
+        return parse_response(response.status_code, response.json)
+
+    def initialize(self, payload):
+        """Start a transaction; the returned data holds the checkout_url"""
+        return self.request('POST', INITIALIZE_PATH, json=payload)
+
+    def verify(self, tx_ref):
+        """Return the transaction data, whose status is e.g. 'success'"""
+        return self.request('GET', verify_path(tx_ref))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncChapaClient:
+    """Event-loop client; use one per loop, ideally as `async with`"""
+
+    def __init__(self, **overrides):
+        config = get_config(**overrides)
+        self.max_retries = config['max_retries']
+        self.backoff = config['backoff']
+        connect, read = config['timeout']
+        self.client = httpx.AsyncClient(
+            base_url=config['base_url'],
+            headers={'Authorization': f"Bearer {config['secret_key']}"},
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(
+                max_connections=config['pool_size'],
+                max_keepalive_connections=config['pool_size'],
+            ),
+        )
+
+    async def request(self, method, path, **kwargs):
+        idempotent = method in IDEMPOTENT_METHODS
+        retry = 0
+        while True:
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as exc:
+                error = exc
+            except httpx.TransportError as exc:
+                if not idempotent:
+                    raise ChapaError(f'Chapa is unreachable: {exc}') from exc
+                error = exc
+            else:
+                retryable = idempotent and response.status_code in RETRY_STATUSES
+                if not retryable or retry >= self.max_retries:
+                    return parse_response(response.status_code, response.json)
+                error = None
+
+            retry += 1
+            if retry > self.max_retries:
+                raise ChapaError(f'Chapa is unreachable: {error}') from error
+            await asyncio.sleep(backoff_delay(self.backoff, retry))
+
+    async def initialize(self, payload):
+        return await self.request('POST', INITIALIZE_PATH, json=payload)
+
+    async def verify(self, tx_ref):
+        return await self.request('GET', verify_path(tx_ref))
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide ChapaClient, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ChapaClient()
+    return _client
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _client
+    if setting.startswith('CHAPA_'):
+        with _client_lock:
+            if _client is not None:
+                _client.close()
+            _client = None
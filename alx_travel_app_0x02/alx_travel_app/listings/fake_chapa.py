@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Chapa API, for tests and offline development.
+
+FakeChapaServer answers transaction/initialize and transaction/verify on
+a local port with Chapa's response shapes, keeps transactions in memory
+and can be told to fail or stall the next requests so that timeouts and
+retries can be exercised. Point CHAPA_BASE_URL at its `url`, or run it
+with `python manage.py fake_chapa`.
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+
+class FakeChapaHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, as Chapa does
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def handle_api(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = urlsplit(self.path).path
+        with self.server.lock:
+            self.server.requests.append((method, path))
+            failure = self.server.failures.pop(0) if self.server.failures else None
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if failure is not None:
+            status, delay = failure
+            if delay:
+                time.sleep(delay)
+            if status is None:
+                # Stalled past the client's read timeout; drop the connection
+                self.close_connection = True
+                return
+            return self.reply(status, {'message': 'Service unavailable', 'status': 'failed'})
+
+        if self.headers.get('Authorization') != f'Bearer {self.server.secret_key}':
+            return self.reply(401, {'message': 'Invalid API Key', 'status': 'failed'})
+
+        prefix = self.server.prefix
+        if method == 'POST' and path == f'{prefix}/transaction/initialize':
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                payload = None
+            return self.initialize(payload)
+        if method == 'GET' and path.startswith(f'{prefix}/transaction/verify/'):
+            return self.verify(unquote(path.rsplit('/', 1)[-1]))
+        self.reply(404, {'message': 'Not found', 'status': 'failed'})
+
+    def initialize(self, payload):
+        if not isinstance(payload, dict):
+            return self.reply(400, {'message': 'Invalid JSON', 'status': 'failed'})
+        missing = [field for field in ('amount', 'currency', 'tx_ref') if not payload.get(field)]
+        if missing:
+            return self.reply(400, {
+                'message': {field: [f'The {field} field is required.'] for field in missing},
+                'status': 'failed',
+                'data': None,
+            })
+
+        tx_ref = str(payload['tx_ref'])
+        with self.server.lock:
+            if tx_ref in self.server.transactions:
+                return self.reply(400, {
+                    'message': 'Transaction reference has been used before',
+                    'status': 'failed',
+                    'data': None,
+                })
+            self.server.transactions[tx_ref] = dict(
+                payload,
+                status=self.server.default_status,
+                reference=uuid.uuid4().hex[:10],
+            )
+        self.reply(200, {
+            'message': 'Hosted Link',
+            'status': 'success',
+            'data': {'checkout_url': f'{self.server.url}/checkout/{tx_ref}'},
+        })
+
+    def verify(self, tx_ref):
+        with self.server.lock:
+            transaction = self.server.transactions.get(tx_ref)
+        if transaction is None:
+            return self.reply(404, {
+                'message': 'Invalid transaction or Transaction not found',
+                'status': 'failed',
+                'data': None,
+            })
+        self.reply(200, {
+            'message': 'Payment details',
+            'status': 'success',
+            'data': dict(transaction),
+        })
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeChapaServer(ThreadingHTTPServer):
+    """In-memory Chapa API served from a background thread.
+
+    transactions maps tx_ref to the initialized payload and its status,
+    requests records every (method, path) received and connections counts
+    the TCP connections accepted. latency delays every answer by that many
+    seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, secret_key='test',
+                 default_status='success', latency=0, verbose=False):
+        super().__init__((host, port), FakeChapaHandler)
+        self.secret_key = secret_key
+        self.default_status = default_status
+        self.latency = latency
+        self.verbose = verbose
+        self.prefix = '/v1'
+        self.lock = threading.Lock()
+        self.transactions = {}
+        self.requests = []
+        self.failures = []
+        self.connections = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{self.prefix}'
+
+    def fail_next(self, count=1, status=503, delay=0):
+        """Answer the next count requests with status after delay seconds;
+        status None never answers and closes the connection instead.
+        """
+        with self.lock:
+            self.failures.extend([(status, delay)] * count)
+
+    def set_status(self, tx_ref, status):
+        with self.lock:
+            self.transactions[tx_ref]['status'] = status
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,5 +1,9 @@
 import django_filters
-from .models import Listing, Booking
+from django.db.models import Count, Exists, OuterRef, Q
+from rest_framework.exceptions import ValidationError
+from .models import Amenity, Listing, Booking
+from .availability import ACTIVE_STATUSES
+from .geo import bounding_box, haversine_km
 
 class ListingFilter(django_filters.FilterSet):
     min_price = django_filters.NumberFilter(field_name='price_per_night', lookup_expr='gte')
@@ -7,6 +11,12 @@ class ListingFilter(django_filters.FilterSet):
     min_bedrooms = django_filters.NumberFilter(field_name='bedrooms', lookup_expr='gte')
     min_bathrooms = django_filters.NumberFilter(field_name='bathrooms', lookup_expr='gte')
     min_guests = django_filters.NumberFilter(field_name='max_guests', lookup_expr='gte')
+    min_rating = django_filters.NumberFilter(field_name='rating_avg', lookup_expr='gte')
+    check_in = django_filters.DateFilter(method='filter_dates')
+    check_out = django_filters.DateFilter(method='filter_dates')
+    amenities = django_filters.CharFilter(method='filter_amenities')
+    near = django_filters.CharFilter(method='filter_near')
+    radius_km = django_filters.NumberFilter(method='filter_near', min_value=0)
     
     class Meta:
         model = Listing
@@ -19,6 +29,79 @@ class ListingFilter(django_filters.FilterSet):
             'bathrooms': ['exact'],
         }
 
+    def filter_amenities(self, queryset, name, value):
+        """Keep listings that have every comma-separated amenity"""
+        names = Amenity.normalize(value)
+        if not names:
+            return queryset
+        matching = (
+            Listing.amenity_set.through.objects
+            .filter(amenity__name__in=names)
+            .values('listing_id')
+            .annotate(matched=Count('amenity_id'))
+            .filter(matched=len(names))
+            .values('listing_id')
+        )
+        return queryset.filter(pk__in=matching)
+
+    def filter_dates(self, queryset, name, value):
+        # The date pair is applied together in filter_queryset
+        return queryset
+
+    def filter_near(self, queryset, name, value):
+        # near and radius_km are applied together in filter_queryset
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        queryset = self.filter_radius(queryset)
+        return self.filter_available(queryset)
+
+    def filter_radius(self, queryset):
+        near = self.form.cleaned_data.get('near')
+        radius_km = self.form.cleaned_data.get('radius_km')
+        if not near and radius_km is None:
+            return queryset
+        if not near or radius_km is None:
+            raise ValidationError('near and radius_km must be given together.')
+        try:
+            lat, lng = (float(part) for part in near.split(','))
+        except ValueError:
+            raise ValidationError('near must be given as lat,lng.')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValidationError('near is outside the valid coordinate range.')
+
+        # Prune with the (latitude, longitude) index, then check exactly
+        radius_km = float(radius_km)
+        min_lat, max_lat, lng_ranges = bounding_box(lat, lng, radius_km)
+        in_lng_range = Q()
+        for min_lng, max_lng in lng_ranges:
+            in_lng_range |= Q(longitude__gte=min_lng, longitude__lte=max_lng)
+        return queryset.filter(
+            in_lng_range, latitude__gte=min_lat, latitude__lte=max_lat
+        ).annotate(
+            distance_km=haversine_km(lat, lng)
+        ).filter(distance_km__lte=radius_km)
+
+    def filter_available(self, queryset):
+        check_in = self.form.cleaned_data.get('check_in')
+        check_out = self.form.cleaned_data.get('check_out')
+        if not check_in and not check_out:
+            return queryset
+        if not check_in or not check_out:
+            raise ValidationError('check_in and check_out must be given together.')
+        if check_in >= check_out:
+            raise ValidationError('check_out must be after check_in.')
+
+        # Anti-join: keep listings with no active booking overlapping the range
+        conflicts = Booking.objects.filter(
+            listing=OuterRef('pk'),
+            status__in=ACTIVE_STATUSES,
+            check_in_date__lt=check_out,
+            check_out_date__gt=check_in,
+        )
+        return queryset.filter(~Exists(conflicts))
+
 class BookingFilter(django_filters.FilterSet):
     check_in_after = django_filters.DateFilter(field_name='check_in_date', lookup_expr='gte')
     check_in_before = django_filters.DateFilter(field_name='check_in_date', lookup_expr='lte')
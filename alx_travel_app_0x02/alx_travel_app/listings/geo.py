@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Distance helpers for radius searches on Listing latitude/longitude."""
+
+import math
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def bounding_box(lat, lng, radius_km):
+    """Return (min_lat, max_lat, lng_ranges) enclosing the circle.
+
+    lng_ranges holds one (min, max) pair, or two when the box crosses the
+    antimeridian.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+
+    # Widest longitude span of the circle, reached at its highest latitude
+    dlng = dlat / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if dlng >= 180.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    min_lng, max_lng = lng - dlng, lng + dlng
+    if min_lng < -180.0:
+        return min_lat, max_lat, [(min_lng + 360.0, 180.0), (-180.0, max_lng)]
+    if max_lng > 180.0:
+        return min_lat, max_lat, [(min_lng, 180.0), (-180.0, max_lng - 360.0)]
+    return min_lat, max_lat, [(min_lng, max_lng)]
+
+
+def haversine_km(lat, lng):
+    """Database expression for the great-circle distance to (lat, lng)"""
+    row_lat = Radians(Cast(F('latitude'), FloatField()))
+    row_lng = Radians(Cast(F('longitude'), FloatField()))
+    half_dlat = (row_lat - Value(math.radians(lat))) / 2
+    half_dlng = (row_lng - Value(math.radians(lng))) / 2
+    a = (
+        Power(Sin(half_dlat), 2)
+        + Value(math.cos(math.radians(lat))) * Cos(row_lat) * Power(Sin(half_dlng), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)))
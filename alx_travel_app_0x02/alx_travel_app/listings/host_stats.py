@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Per-host monthly booking statistics stored in HostMonthlyStats.
+
+The Booking signal handlers in signals.py pass every saved or deleted
+booking here. Its old and new contributions are diffed per month and each
+changed month gets one UPDATE computed from the stored columns, so the
+dashboard never scans bookings. A month whose stored values cannot absorb
+the change (they missed writes made without signals: QuerySet.update,
+bulk_create, raw SQL) is recounted for that host instead; the
+rebuild_host_stats command recounts everyone.
+"""
+
+from collections import defaultdict
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Booking, HostMonthlyStats, Listing
+
+REVENUE_STATUSES = ('confirmed', 'completed')
+FIELDS = (
+    'pending_bookings', 'confirmed_bookings', 'cancelled_bookings', 'completed_bookings',
+    'booked_nights', 'revenue',
+)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def booking_stats(status, check_in, check_out, total_price):
+    """A booking's contribution as {month: {field: value}}"""
+    stats = defaultdict(dict)
+    stats[check_in.replace(day=1)][f'{status}_bookings'] = 1
+    if status in REVENUE_STATUSES:
+        stats[check_in.replace(day=1)]['revenue'] = total_price
+        month = check_in.replace(day=1)
+        while month < check_out:
+            end = next_month(month)
+            stats[month]['booked_nights'] = (min(end, check_out) - max(month, check_in)).days
+            month = end
+    return stats
+
+
+def host_of(booking, listing_id):
+    if Booking.listing.is_cached(booking) and booking.listing.pk == listing_id:
+        return booking.listing.host_id
+    return Listing.objects.filter(pk=listing_id).values_list('host_id', flat=True).first()
+
+
+def apply_stats(host_id, stats, sign=1):
+    """Add (sign=1) or remove (sign=-1) {month: {field: value}} for a host"""
+    for month, values in stats.items():
+        delta = {field: sign * value for field, value in values.items() if value}
+        if not delta:
+            continue
+        rows = HostMonthlyStats.objects.filter(host_id=host_id, month=month)
+        guards = {f'{field}__gte': -value for field, value in delta.items() if value < 0}
+        changes = {field: F(field) + value for field, value in delta.items()}
+        if rows.filter(**guards).update(**changes):
+            continue
+        if not guards:
+            # First booking of the month
+            try:
+                with transaction.atomic():
+                    HostMonthlyStats.objects.create(host_id=host_id, month=month)
+            except IntegrityError:
+                pass  # Created by a concurrent booking
+            if rows.update(**changes):
+                continue
+        # The stored values missed bookings written without signals
+        rebuild_host_stats([host_id])
+        return
+
+
+def merge(old, new):
+    """new minus old, as {month: {field: change}}"""
+    changes = defaultdict(dict)
+    for sign, stats in ((-1, old), (1, new)):
+        for month, values in stats.items():
+            for field, value in values.items():
+                changes[month][field] = changes[month].get(field, 0) + sign * value
+    return changes
+
+
+def booking_state(booking):
+    return (booking.listing_id, booking.status, booking.check_in_date,
+            booking.check_out_date, booking.total_price)
+
+
+def booking_saved(booking, created):
+    loaded = getattr(booking, '_loaded', None)
+    new = booking_state(booking)
+    booking._loaded = new
+    new_host = host_of(booking, new[0])
+    if created:
+        apply_stats(new_host, booking_stats(*new[1:]))
+    elif loaded is None or None in loaded:
+        # Saved without being loaded first, so the old values are unknown
+        rebuild_host_stats([new_host])
+    elif loaded[0] == new[0]:
+        if loaded != new:
+            apply_stats(new_host, merge(booking_stats(*loaded[1:]), booking_stats(*new[1:])))
+    else:
+        apply_stats(host_of(booking, loaded[0]), booking_stats(*loaded[1:]), -1)
+        apply_stats(new_host, booking_stats(*new[1:]))
+
+
+def booking_deleted(booking):
+    loaded = getattr(booking, '_loaded', None) or booking_state(booking)
+    host_id = host_of(booking, loaded[0])
+    if host_id is not None:
+        apply_stats(host_id, booking_stats(*loaded[1:]), -1)
+
+
+def rebuild_host_stats(host_ids=None, batch_size=2000):
+    """Recount the statistics of the given hosts (default: every host with
+    listings) from their bookings. Returns the number of hosts rebuilt.
+    """
+    if host_ids is None:
+        host_ids = Listing.objects.order_by('host_id').values_list('host_id', flat=True).distinct()
+    rebuilt = 0
+    for host_id in list(host_ids):
+        totals = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+        bookings = Booking.objects.filter(listing__host_id=host_id).values_list(
+            'status', 'check_in_date', 'check_out_date', 'total_price'
+        )
+        for row in bookings.iterator(chunk_size=batch_size):
+            for month, values in booking_stats(*row).items():
+                for field, value in values.items():
+                    totals[month][field] += value
+        with transaction.atomic():
+            HostMonthlyStats.objects.filter(host_id=host_id).delete()
+            HostMonthlyStats.objects.bulk_create([
+                HostMonthlyStats(host_id=host_id, month=month, **values)
+                for month, values in totals.items()
+            ], batch_size=batch_size)
+        rebuilt += 1
+    return rebuilt
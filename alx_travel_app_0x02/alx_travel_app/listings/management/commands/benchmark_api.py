@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Benchmark the listings and bookings API on a fixed, seeded dataset.
+
+A fresh test database is created and seeded by the seeds command with a
+fixed --seed. Every scenario then sends --requests requests through DRF's
+test client, so URL routing, views, serialization and rendering are all
+measured. List scenarios read one page of 20: a keyset page, or a
+numbered one for search and ordering, which cannot take a cursor. Per
+scenario the command records p50/p95/p99 and mean latency, throughput
+and SQL queries per request. Results are written as JSON with
+stable key order, so the files of two commits can be diffed or passed to
+--compare.
+"""
+
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import date, timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from listings.models import Booking, Listing
+
+User = get_user_model()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = round(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API endpoints on a seeded test database and write JSON results. "
+        "List scenarios read one page of 20; search and ordering use numbered pages "
+        "(page_size) since they cannot take a cursor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=2000)
+        parser.add_argument('--bookings', type=int, default=6000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--requests', type=int, default=200,
+                            help="Timed requests per scenario")
+        parser.add_argument('--warmup', type=int, default=10,
+                            help="Untimed requests per scenario")
+        parser.add_argument('--cache', action='store_true',
+                            help="Keep the anonymous response cache on")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Reuse the seeded test database of a previous run")
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare', help="Earlier results to print changes against")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb']
+        )
+        try:
+            if not Listing.objects.exists():
+                call_command(
+                    'seeds', listings=options['listings'], bookings=options['bookings'],
+                    users=options['users'], seed=options['seed'], workers=1,
+                    stdout=io.StringIO()
+                )
+            timeout = getattr(settings, 'LISTING_CACHE_TIMEOUT', 300) if options['cache'] else 0
+            hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+            with override_settings(LISTING_CACHE_TIMEOUT=timeout, ALLOWED_HOSTS=hosts):
+                results = self.run_scenarios(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        report = {
+            'environment': self.environment(),
+            'config': {
+                key: options[key]
+                for key in ('listings', 'bookings', 'users', 'seed', 'requests', 'warmup', 'cache')
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write('\n')
+
+        self.print_table(results, options['compare'])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def scenarios(self, rnd):
+        """(name, authenticated, make_request) where make_request returns
+        (method, path, data) for the next request.
+        """
+        listing_ids = list(Listing.objects.order_by('pk').values_list('pk', flat=True))
+        cities = sorted(set(Listing.objects.values_list('city', flat=True)))
+        words = sorted({word for city in cities for word in city.split()})
+        points = list(Listing.objects.order_by('pk').values_list('latitude', 'longitude')[:100])
+        list_url = reverse('listings:listing-list')
+        page = {'cursor': '', 'page_size': 20}
+        # Relevance and ordering are not keyset orders, so these are paged
+        # by number instead
+        numbered = {'page_size': 20}
+        today = date.today()
+        new_booking = iter(range(10 ** 9))
+
+        def dates(start_days):
+            check_in = today + timedelta(days=start_days)
+            return {'check_in': str(check_in), 'check_out': str(check_in + timedelta(days=3))}
+
+        def near():
+            lat, lng = rnd.choice(points)
+            return {**page, 'near': f'{lat},{lng}', 'radius_km': 500}
+
+        def create():
+            # Dates past every seeded calendar, never reused, so each
+            # request books successfully
+            n = next(new_booking)
+            check_in = today + timedelta(days=3 * 365 + 4 * (n // len(listing_ids)))
+            return 'post', reverse('listings:booking-list'), {
+                'listing_id': listing_ids[n % len(listing_ids)],
+                'check_in_date': str(check_in),
+                'check_out_date': str(check_in + timedelta(days=3)),
+                'guests_count': 1,
+            }
+
+        return [
+            ('listings.list', False, lambda: ('get', list_url, page)),
+            ('listings.list.filter', False, lambda: ('get', list_url, {
+                **page, 'city': rnd.choice(cities), 'min_bedrooms': 2, 'max_price': 250,
+            })),
+            ('listings.list.search', False, lambda: ('get', list_url, {
+                **numbered, 'search': rnd.choice(words),
+            })),
+            ('listings.list.ordering', False, lambda: ('get', list_url, {
+                **numbered, 'ordering': '-price_per_night', 'min_bedrooms': 4,
+                'property_type': rnd.choice(['apartment', 'house', 'villa']),
+            })),
+            ('listings.list.available', False, lambda: ('get', list_url, {
+                **page, **dates(rnd.randint(0, 60)),
+            })),
+            ('listings.list.near', False, lambda: ('get', list_url, near())),
+            ('listings.retrieve', False, lambda: (
+                'get', reverse('listings:listing-detail', args=[rnd.choice(listing_ids)]), {}
+            )),
+            ('listings.availability', False, lambda: (
+                'get', reverse('listings:listing-availability', args=[rnd.choice(listing_ids)]),
+                dates(rnd.randint(0, 60)),
+            )),
+            ('bookings.list', True, lambda: ('get', reverse('listings:booking-list'), page)),
+            ('bookings.create', True, create),
+        ]
+
+    def run_scenarios(self, options):
+        rnd = random.Random(options['seed'])
+        busiest = (
+            Booking.objects.values('guest').annotate(n=Count('pk')).order_by('-n', 'guest').first()
+        )
+        guest = User.objects.get(pk=busiest['guest']) if busiest else User.objects.order_by('pk').first()
+        results = {}
+        for name, authenticated, make_request in self.scenarios(rnd):
+            client = APIClient()
+            if authenticated:
+                client.force_authenticate(guest)
+
+            def send():
+                method, path, data = make_request()
+                if method == 'post':
+                    return client.post(path, data, format='json')
+                return client.get(path, data)
+
+            for _ in range(options['warmup']):
+                send()
+
+            timings, queries, statuses = [], [], {}
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = send()
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(captured.captured_queries))
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            elapsed = time.perf_counter() - started
+
+            timings.sort()
+            results[name] = {
+                'requests': len(timings),
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'mean_ms': round(statistics.fmean(timings), 3),
+                'throughput_rps': round(len(timings) / elapsed, 1),
+                'queries_mean': round(statistics.fmean(queries), 2),
+                'queries_max': max(queries),
+                'statuses': statuses,
+            }
+            self.stdout.write(f"{name}: p95 {results[name]['p95_ms']:.2f} ms")
+        return results
+
+    def environment(self):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                check=True, cwd=os.path.dirname(__file__)
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'machine': platform.machine(),
+        }
+
+    def print_table(self, results, compare):
+        previous = {}
+        if compare:
+            with open(compare) as file:
+                previous = json.load(file)['results']
+
+        self.stdout.write(
+            f"{'scenario':<26} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+            f"{'req/s':>8} {'queries':>8}" + (f" {'p95 change':>11}" if previous else '')
+        )
+        for name, result in results.items():
+            line = (
+                f"{name:<26} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                f"{result['p99_ms']:>9.2f} {result['throughput_rps']:>8.1f} "
+                f"{result['queries_mean']:>8.1f}"
+            )
+            if name in previous and previous[name]['p95_ms']:
+                change = result['p95_ms'] / previous[name]['p95_ms'] - 1
+                line += f" {change:>+10.1%}"
+            self.stdout.write(line)
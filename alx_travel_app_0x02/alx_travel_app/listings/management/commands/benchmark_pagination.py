@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Compare offset and keyset pagination latency on deep listing pages.
+
+The listings are bulk created in a fresh test database that is dropped
+afterwards (kept with --keepdb), so the configured database is never
+touched. bulk_create sends no signals, so that database has no search
+index, ratings or cached pages, none of which the timed requests use.
+"""
+
+import statistics
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIRequestFactory
+from listings.models import Listing
+from listings.pagination import KeysetPagination
+from listings.views import ListingViewSet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Time page 1 against deep pages with offset and keyset pagination"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=1_000_000,
+                            help="Top the table up to this many listings first")
+        parser.add_argument('--pages', default='1,100,10000',
+                            help="Comma-separated page numbers to time")
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keepdb', action='store_true',
+                            help="Reuse the test database of a previous run")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb']
+        )
+        try:
+            self.top_up(options['listings'])
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+    def run(self, options):
+        page_size = options['page_size']
+        view = ListingViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        queryset = Listing.objects.order_by('-created_at', '-id')
+
+        # The offset column times the bare LIMIT/OFFSET query; the keyset
+        # column times a full API request, serialization included
+        self.stdout.write(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+        for page in [int(value) for value in options['pages'].split(',')]:
+            offset = (page - 1) * page_size
+
+            def offset_page():
+                list(queryset[offset:offset + page_size])
+
+            # Locate the cursor of the page outside the timed section
+            cursor = ''
+            if offset:
+                last = queryset.values_list('created_at', 'id')[offset - 1]
+                cursor = KeysetPagination().encode_cursor(last)
+            request = factory.get(
+                '/listings/', {'cursor': cursor, 'page_size': page_size}
+            )
+
+            def keyset_page():
+                view(request).render()
+
+            self.stdout.write(
+                f"{page:>8} {self.median_ms(offset_page, options['repeat']):>12.2f} "
+                f"{self.median_ms(keyset_page, options['repeat']):>12.2f}"
+            )
+
+    def median_ms(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def top_up(self, target, batch_size=10_000):
+        missing = target - Listing.objects.count()
+        if missing <= 0:
+            return
+        host, _ = User.objects.get_or_create(username='benchmark_host')
+        self.stdout.write(f"Creating {missing} listings...")
+        while missing > 0:
+            count = min(batch_size, missing)
+            Listing.objects.bulk_create([
+                Listing(
+                    title=f'Benchmark listing {i}',
+                    description='Benchmark listing',
+                    property_type='apartment',
+                    price_per_night=Decimal('50.00'),
+                    bedrooms=1,
+                    bathrooms=1,
+                    max_guests=2,
+                    address='1 Benchmark Street',
+                    city='Addis Ababa',
+                    state='Addis Ababa',
+                    country='Ethiopia',
+                    postal_code='1000',
+                    amenities='wifi',
+                    host=host,
+                )
+                for i in range(count)
+            ])
+            missing -= count
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""Serve the fake Chapa API locally for offline development."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from listings.fake_chapa import FakeChapaServer
+
+
+class Command(BaseCommand):
+    help = "Run a local fake Chapa API; point CHAPA_BASE_URL at the printed URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--status', default='success',
+                            help="Status verify reports for new transactions")
+
+    def handle(self, *args, **options):
+        server = FakeChapaServer(
+            host=options['host'],
+            port=options['port'],
+            secret_key=getattr(settings, 'CHAPA_SECRET_KEY', None) or 'test',
+            default_status=options['status'],
+            verbose=True,
+        )
+        self.stdout.write(f"Fake Chapa API listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
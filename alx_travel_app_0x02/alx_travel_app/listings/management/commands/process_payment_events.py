@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Worker verifying queued Chapa payment events in batches."""
+
+import time
+
+from django.core.management.base import BaseCommand
+from listings.payments import process_payment_events
+
+
+class Command(BaseCommand):
+    help = "Verify queued payment events against Chapa and update payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help="Verify calls in flight at once")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep polling the queue instead of exiting when empty")
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help="Seconds to wait while the queue is empty")
+
+    def handle(self, *args, **options):
+        total_events = total_updated = 0
+        try:
+            while True:
+                events, updated = process_payment_events(
+                    options['batch_size'], options['concurrency']
+                )
+                total_events += events
+                total_updated += updated
+                if events:
+                    self.stdout.write(f"Processed {events} events, updated {updated} payments")
+                elif not options['loop']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total_events} events processed, {total_updated} payments updated"
+        ))
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""Recompute host dashboard statistics from the bookings table."""
+
+from django.core.management.base import BaseCommand
+from listings.host_stats import rebuild_host_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the monthly booking statistics of every host from their bookings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=int, action='append', dest='hosts',
+                            help="Only this host id (repeatable)")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        total = rebuild_host_stats(options['hosts'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt statistics of {total} hosts."))
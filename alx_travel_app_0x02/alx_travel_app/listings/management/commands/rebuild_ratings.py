@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""Recompute listing review aggregates from the reviews table."""
+
+from django.core.management.base import BaseCommand
+from listings.cache import LIST_VERSION_KEY, bump_version
+from listings.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute review_count and rating_avg of every listing from its reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = rebuild_ratings(batch_size=options['batch_size'])
+        # Cached list pages may show the old ratings
+        bump_version(LIST_VERSION_KEY)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings of {total} listings."))
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""Rebuild the full-text search index of listings."""
+
+from django.core.management.base import BaseCommand
+from listings.search import is_supported, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from the listings table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            self.stdout.write(self.style.WARNING(
+                "Full-text search is not supported on this database; nothing to do."
+            ))
+            return
+
+        total = rebuild_search_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} listings."))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Reconcile Pending payments against Chapa, resumably."""
+
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from listings.chapa import ChapaError
+from listings.payments import payment_status, reconcile_pending
+
+
+class Command(BaseCommand):
+    help = "Verify every Pending payment with Chapa and update its status"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Payments read, verified and written per step")
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help="Verify calls in flight at once")
+        parser.add_argument('--checkpoint',
+                            help="File recording progress; an interrupted run resumes from it")
+        parser.add_argument('--restart', action='store_true',
+                            help="Ignore an existing checkpoint")
+        parser.add_argument('--output',
+                            help="Append one CSV row per payment to this file ('-' for stdout, "
+                                 "progress then goes to stderr)")
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        # Keep progress out of a CSV written to stdout
+        self.log = self.stderr if options['output'] == '-' else self.stdout
+        progress = {'last_pk': 0, 'verified': 0, 'updated': 0, 'errors': 0}
+        if checkpoint and not options['restart'] and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                progress.update(json.load(file))
+            self.log.write(f"Resuming after payment {progress['last_pk']}")
+
+        output = self.open_output(options['output'], resume=progress['last_pk'] > 0)
+        try:
+            chunks = reconcile_pending(
+                progress['last_pk'], options['chunk_size'], options['concurrency']
+            )
+            for chunk in chunks:
+                for pk, tx_ref, result in chunk:
+                    if isinstance(result, ChapaError):
+                        progress['errors'] += 1
+                        row = [pk, tx_ref, 'Pending', str(result)]
+                    else:
+                        status = payment_status(result)
+                        progress['updated'] += status != 'Pending'
+                        row = [pk, tx_ref, status, '']
+                    if output:
+                        output.writerow(row)
+                progress['verified'] += len(chunk)
+                progress['last_pk'] = chunk[-1][0]
+                self.save_checkpoint(checkpoint, progress)
+                self.log.write(
+                    f"Verified {progress['verified']} payments, "
+                    f"updated {progress['updated']}, errors {progress['errors']}"
+                )
+        finally:
+            if output and self.output_file is not self.stdout:
+                self.output_file.close()
+
+        if checkpoint and os.path.exists(checkpoint):
+            # Finished, so the next run starts from the beginning
+            os.remove(checkpoint)
+        self.log.write(self.style.SUCCESS(
+            f"Done: {progress['verified']} verified, {progress['updated']} updated, "
+            f"{progress['errors']} left Pending after errors."
+        ))
+
+    def open_output(self, path, resume):
+        if not path:
+            self.output_file = None
+            return None
+        if path == '-':
+            # Through the command's stdout, so call_command(stdout=...) gets it
+            self.output_file = self.stdout
+        else:
+            self.output_file = open(path, 'a' if resume else 'w', newline='')
+        writer = csv.writer(self.output_file)
+        if not resume:
+            writer.writerow(['payment_id', 'tx_ref', 'status', 'error'])
+        return writer
+
+    def save_checkpoint(self, path, progress):
+        if self.output_file:
+            self.output_file.flush()
+        if not path:
+            return
+        # Write then rename, so an interrupted write never corrupts the file
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(progress, file)
+        os.replace(f'{path}.tmp', path)
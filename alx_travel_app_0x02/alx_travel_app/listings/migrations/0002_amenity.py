@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Amenity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'amenities',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='amenity_set',
+            field=models.ManyToManyField(blank=True, related_name='listings', to='listings.amenity'),
+        ),
+    ]
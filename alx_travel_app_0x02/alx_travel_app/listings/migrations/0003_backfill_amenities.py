@@ -0,0 +1,51 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def normalize(value):
+    names = (' '.join(part.split()).lower() for part in value.split(','))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def link_batch(Amenity, ListingAmenity, batch):
+    names = {name for _, values in batch for name in values}
+    Amenity.objects.bulk_create(
+        [Amenity(name=name) for name in sorted(names)], ignore_conflicts=True
+    )
+    amenity_ids = dict(Amenity.objects.filter(name__in=names).values_list('name', 'pk'))
+    ListingAmenity.objects.bulk_create(
+        [
+            ListingAmenity(listing_id=pk, amenity_id=amenity_ids[name])
+            for pk, values in batch
+            for name in values
+        ],
+        ignore_conflicts=True
+    )
+
+
+def backfill_amenities(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    Amenity = apps.get_model('listings', 'Amenity')
+    ListingAmenity = Listing.amenity_set.through
+
+    batch = []
+    rows = Listing.objects.order_by().values_list('pk', 'amenities')
+    for pk, text in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append((pk, normalize(text or '')))
+        if len(batch) >= BATCH_SIZE:
+            link_batch(Amenity, ListingAmenity, batch)
+            batch = []
+    if batch:
+        link_batch(Amenity, ListingAmenity, batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0002_amenity'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_amenities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_listing_lat_lng_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='full_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='tx_ref',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_paymentevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='booking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='listings.booking'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_url',
+            field=models.URLField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
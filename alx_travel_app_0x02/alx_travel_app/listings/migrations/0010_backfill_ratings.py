@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+BATCH_SIZE = 1000
+
+
+def backfill_ratings(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    Review = apps.get_model('listings', 'Review')
+
+    reviews = Review.objects.filter(listing=OuterRef('pk')).order_by().values('listing')
+    count = Coalesce(
+        Subquery(reviews.annotate(n=Count('pk')).values('n')), 0, output_field=IntegerField()
+    )
+    total = Coalesce(
+        Subquery(reviews.annotate(n=Sum('rating')).values('n')), 0, output_field=IntegerField()
+    )
+    average = Case(
+        When(review_count=0, then=Value(0.0)),
+        default=Cast(F('rating_total'), FloatField()) / F('review_count'),
+        output_field=FloatField(),
+    )
+
+    reviewed = Review.objects.order_by('listing_id').values_list('listing_id', flat=True).distinct()
+    batch = []
+    for pk in reviewed.iterator(chunk_size=BATCH_SIZE):
+        batch.append(pk)
+        if len(batch) >= BATCH_SIZE:
+            Listing.objects.filter(pk__in=batch).update(review_count=count, rating_total=total)
+            Listing.objects.filter(pk__in=batch).update(rating_avg=average)
+            batch = []
+    if batch:
+        Listing.objects.filter(pk__in=batch).update(review_count=count, rating_total=total)
+        Listing.objects.filter(pk__in=batch).update(rating_avg=average)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0009_listing_rating'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:32
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('listings', '0011_pricerule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostMonthlyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('pending_bookings', models.PositiveIntegerField(default=0)),
+                ('confirmed_bookings', models.PositiveIntegerField(default=0)),
+                ('cancelled_bookings', models.PositiveIntegerField(default=0)),
+                ('completed_bookings', models.PositiveIntegerField(default=0)),
+                ('booked_nights', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('host', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'host monthly stats',
+                'ordering': ['host', '-month'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hostmonthlystats',
+            constraint=models.UniqueConstraint(fields=('host', 'month'), name='host_month_unique'),
+        ),
+    ]
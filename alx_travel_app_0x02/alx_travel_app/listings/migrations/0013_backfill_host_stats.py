@@ -0,0 +1,56 @@
+from collections import defaultdict
+from datetime import date
+
+from django.db import migrations
+
+BATCH_SIZE = 2000
+FIELDS = (
+    'pending_bookings', 'confirmed_bookings', 'cancelled_bookings', 'completed_bookings',
+    'booked_nights', 'revenue',
+)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def backfill_host_stats(apps, schema_editor):
+    Booking = apps.get_model('listings', 'Booking')
+    HostMonthlyStats = apps.get_model('listings', 'HostMonthlyStats')
+
+    totals = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+    bookings = Booking.objects.values_list(
+        'listing__host_id', 'status', 'check_in_date', 'check_out_date', 'total_price'
+    ).order_by()
+    for host_id, status, check_in, check_out, total_price in bookings.iterator(chunk_size=BATCH_SIZE):
+        first = check_in.replace(day=1)
+        totals[host_id, first][f'{status}_bookings'] += 1
+        if status in ('confirmed', 'completed'):
+            totals[host_id, first]['revenue'] += total_price
+            month = first
+            while month < check_out:
+                end = next_month(month)
+                totals[host_id, month]['booked_nights'] += (min(end, check_out) - max(month, check_in)).days
+                month = end
+
+    # Recount from scratch, whatever was recorded before
+    HostMonthlyStats.objects.all().delete()
+    HostMonthlyStats.objects.bulk_create([
+        HostMonthlyStats(host_id=host_id, month=month, **values)
+        for (host_id, month), values in totals.items()
+    ], batch_size=BATCH_SIZE)
+
+
+def remove_host_stats(apps, schema_editor):
+    apps.get_model('listings', 'HostMonthlyStats').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0012_hostmonthlystats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_host_stats, remove_host_stats),
+    ]
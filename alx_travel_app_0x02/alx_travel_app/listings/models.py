@@ -4,13 +4,29 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 import uuid
+from django.core.validators import MinValueValidator, MaxValueValidator
+from decimal import Decimal
 
 User = get_user_model()
 
-class Listing(models.Model):from django.db import models
-from django.contrib.auth.models import User
-from django.core.validators import MinValueValidator, MaxValueValidator
-from decimal import Decimal
+class Amenity(models.Model):
+    """
+    A normalized amenity name shared by many listings.
+    """
+    name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'amenities'
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def normalize(value):
+        """Split comma-separated text into unique, lower-cased names"""
+        names = (' '.join(part.split()).lower() for part in value.split(','))
+        return list(dict.fromkeys(name for name in names if name))
 
 class Listing(models.Model):
     PROPERTY_TYPES = [
@@ -48,9 +64,14 @@ class Listing(models.Model):
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     amenities = models.TextField(help_text="Comma-separated list of amenities")
+    amenity_set = models.ManyToManyField(Amenity, related_name='listings', blank=True)
     house_rules = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
+    # Review aggregates maintained by ratings.py; rating_avg is 0 without reviews
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_total = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     image = models.ImageField(upload_to='listings/', null=True, blank=True)
@@ -61,6 +82,9 @@ class Listing(models.Model):
             models.Index(fields=['city', 'status']),
             models.Index(fields=['property_type', 'status']),
             models.Index(fields=['price_per_night']),
+            models.Index(fields=['created_at', 'id'], name='listing_created_keyset_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='listing_lat_lng_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='listing_rating_idx'),
         ]
 
     def __str__(self):
@@ -68,7 +92,54 @@ class Listing(models.Model):
 
     @property
     def amenities_list(self):
-        return [amenity.strip() for amenity in self.amenities.split(',') if amenity.strip()]
+        return [amenity.name for amenity in self.amenity_set.all()]
+
+    def sync_amenities(self):
+        """Point amenity_set at the amenities named in the amenities text"""
+        names = Amenity.normalize(self.amenities)
+        existing = set(Amenity.objects.filter(name__in=names).values_list('name', flat=True))
+        Amenity.objects.bulk_create(
+            [Amenity(name=name) for name in names if name not in existing],
+            ignore_conflicts=True
+        )
+        self.amenity_set.set(Amenity.objects.filter(name__in=names))
+
+class PriceRule(models.Model):
+    """
+    A nightly rate replacing the listing's price_per_night for the nights
+    from start_date up to (not including) end_date that fall on one of the
+    weekdays in the bitmask (bit 0 = Monday). Open-ended on a missing date.
+    Where rules overlap, the highest priority wins, then the newest rule.
+    """
+    ALL_DAYS = 0b1111111
+    WEEKEND = 0b0110000  # Friday and Saturday nights
+
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='price_rules')
+    label = models.CharField(max_length=100, blank=True)
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    weekdays = models.PositiveSmallIntegerField(
+        default=ALL_DAYS, validators=[MinValueValidator(1), MaxValueValidator(ALL_DAYS)]
+    )
+    price_per_night = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))]
+    )
+    priority = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-priority', '-id']
+        indexes = [
+            models.Index(fields=['listing', 'start_date']),
+        ]
+
+    def __str__(self):
+        return f"{self.label or 'Rate'} {self.price_per_night} - {self.listing_id}"
+
+    def applies_on(self, weekday):
+        return bool(self.weekdays >> weekday & 1)
 
 class Booking(models.Model):
     STATUS_CHOICES = [
@@ -95,6 +166,7 @@ class Booking(models.Model):
             models.Index(fields=['listing', 'status']),
             models.Index(fields=['guest', 'status']),
             models.Index(fields=['check_in_date', 'check_out_date']),
+            models.Index(fields=['created_at', 'id'], name='booking_created_keyset_idx'),
         ]
 
     def __str__(self):
@@ -115,40 +187,89 @@ class Booking(models.Model):
     def duration_days(self):
         return (self.check_out_date - self.check_in_date).days
 
-    """
-    Represents a rental listing.
-    """
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    title = models.CharField(max_length=255)
-    description = models.TextField()
-    price_per_night = models.DecimalField(max_digits=8, decimal_places=2)
-    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="listings")
-    location = models.CharField(max_length=255)
-
-    def __str__(self):
-        return self.title
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so that signals can apply the change
+        # to the host's statistics
+        instance._loaded = tuple(
+            instance.__dict__.get(name) for name in
+            ('listing_id', 'status', 'check_in_date', 'check_out_date', 'total_price')
+        )
+        return instance
 
-class Booking(models.Model):
+class HostMonthlyStats(models.Model):
     """
-    Represents a booking for a listing.
+    A host's bookings by status, booked nights and revenue for one month,
+    maintained by host_stats.py. Bookings count in the month of check-in,
+    nights in the month they fall in.
     """
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="bookings")
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bookings")
-    start_date = models.DateField()
-    end_date = models.DateField()
+    host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_stats')
+    month = models.DateField(help_text="First day of the month")
+    pending_bookings = models.PositiveIntegerField(default=0)
+    confirmed_bookings = models.PositiveIntegerField(default=0)
+    cancelled_bookings = models.PositiveIntegerField(default=0)
+    completed_bookings = models.PositiveIntegerField(default=0)
+    # Confirmed and completed bookings only
+    booked_nights = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        ordering = ['host', '-month']
+        constraints = [
+            models.UniqueConstraint(fields=['host', 'month'], name='host_month_unique'),
+        ]
+        verbose_name_plural = 'host monthly stats'
 
     def __str__(self):
-        return f"Booking by {self.user} for {self.listing}"
+        return f"{self.host} {self.month:%Y-%m}"
+
 class Payment(models.Model):
+    booking = models.ForeignKey(
+        Booking, on_delete=models.SET_NULL, null=True, blank=True, related_name="payments"
+    )
     booking_reference = models.CharField(max_length=100)
+    full_name = models.CharField(max_length=255, blank=True)
+    email = models.EmailField(blank=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    tx_ref = models.CharField(max_length=100, unique=True, null=True, blank=True)
+    # Same booking and amount within one idempotency window, see payments.py
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    checkout_url = models.URLField(max_length=500, blank=True)
     transaction_id = models.CharField(max_length=100, blank=True, null=True)
     status = models.CharField(max_length=20, default='Pending')  # Pending, Completed, Failed
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also when an initiation claim was last taken, see payments.take_over_stale_claim
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.booking_reference} - {self.status}"
+
+
+class PaymentEvent(models.Model):
+    """
+    A payment notification from Chapa, queued for verification.
+    """
+    tx_ref = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at']
+        indexes = [
+            # Only the unprocessed queue is scanned, so only it is indexed
+            models.Index(
+                fields=['received_at'],
+                condition=models.Q(processed_at__isnull=True),
+                name='payment_event_queue_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.tx_ref} @ {self.received_at}"
+
+
 class Review(models.Model):
     """
     Represents a review for a listing.
@@ -161,3 +282,11 @@ class Review(models.Model):
 
     def __str__(self):
         return f"Review by {self.user} for {self.listing}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so that signals can apply the change
+        # to the listing's rating aggregates
+        instance._loaded = (instance.__dict__.get('listing_id'), instance.__dict__.get('rating'))
+        return instance
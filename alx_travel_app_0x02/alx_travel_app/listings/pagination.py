@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Opt-in keyset (cursor) pagination for listings and bookings.
+
+Requests that carry a `cursor` query parameter (empty for the first page)
+are paginated on (created_at, id), newest first. Each page is a range scan
+of the (created_at, id) index starting after the last row of the previous
+page, so deep pages cost the same as the first one and rows inserted while
+a client is paging do not shift later pages. Since the order is fixed,
+`ordering` and `search` (relevance order) are rejected alongside a cursor
+rather than silently ignored. Requests without a cursor keep the project's
+default pagination; where it has none, those with a `page_size` get
+numbered pages (`page`) of that size, so relevance or `ordering` results
+can still be read a page at a time.
+"""
+
+import base64
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class PageSizePagination(PageNumberPagination):
+    """Numbered pages for requests without a cursor that ask for a page_size"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        default_class = api_settings.DEFAULT_PAGINATION_CLASS
+        self.fallback = default_class() if default_class else None
+        self.keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            if self.fallback is None and self.page_size_query_param in request.query_params:
+                self.fallback = PageSizePagination()
+            if self.fallback is None:
+                return None
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        conflicting = [
+            param for param in (api_settings.ORDERING_PARAM, api_settings.SEARCH_PARAM)
+            if request.query_params.get(param)
+        ]
+        if conflicting:
+            raise ValidationError({
+                param: [f'Cannot be combined with {self.cursor_query_param}; '
+                        f'cursor pages are ordered newest first.']
+                for param in conflicting
+            })
+
+        self.keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-created_at', '-id')
+
+        position = self.decode_cursor(request.query_params[self.cursor_query_param])
+        if position is not None:
+            created_at, pk = position
+            # (created_at, id) < (created_at', id') written so that the
+            # created_at bound can seek into the index
+            queryset = queryset.filter(
+                Q(created_at__lte=created_at) & ~Q(created_at=created_at, id__gte=pk)
+            )
+
+        # Fetch one extra row to know whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        page = rows[:page_size]
+        self.next_position = (page[-1].created_at, page[-1].pk) if self.has_next else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, position):
+        created_at, pk = position
+        raw = f'{created_at.isoformat()}|{pk}'.encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, value):
+        if not value:
+            return None
+        try:
+            created_at, pk = base64.urlsafe_b64decode(value.encode()).decode().split('|')
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return self.fallback.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opt into keyset pagination; leave empty for the first page',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results per page; without a cursor, '
+                               'numbered pages are served (see page)',
+                'schema': {'type': 'integer'},
+            },
+        ]
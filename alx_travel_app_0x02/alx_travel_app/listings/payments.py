@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Payment initiation keys and background verification of Chapa events.
+
+claim_payment gives retried initiations of a booking and amount within
+PAYMENT_IDEMPOTENCY_WINDOW seconds (default: 900) of the last one the same
+Payment, so a single Chapa checkout session; later ones are answered with
+the stored checkout_url. The window slides with each payment, so two
+retries a few seconds apart always share it. Concurrent initiations that
+find no payment in the window race on the unique Payment.idempotency_key,
+which names the booking, amount and the payment they follow, so exactly
+one of them claims a new row. A claim that got no
+checkout_url within PAYMENT_CLAIM_TIMEOUT seconds (default: 120; its worker
+died mid-initiation) is taken over by the next retry.
+
+The webhook view only stores each notification as a PaymentEvent, so
+checkout traffic never waits on Chapa. process_payment_events takes a batch
+of queued events, verifies their distinct tx_refs concurrently with
+AsyncChapaClient, bulk-updates the Payment rows whose status changed and
+marks the events processed. Events whose verification failed because
+Chapa was unavailable stay queued for the next batch.
+
+reconcile_pending does the same for Pending payments directly, streaming
+them in primary key order so that a caller can checkpoint its progress.
+
+Running the same batch twice is harmless, as verification is read-only and
+the status update idempotent.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .chapa import AsyncChapaClient, ChapaError
+from .models import Payment, PaymentEvent
+
+
+def idempotency_key(booking_id, amount, previous_id=None):
+    """Key of a new payment of the booking and amount, naming the payment it
+    follows (previous_id, None for the first), so that concurrent claims of
+    the same new payment collide.
+    """
+    amount = Decimal(amount).quantize(Decimal('0.01'))
+    return hashlib.sha256(f'{booking_id}:{amount}:{previous_id or 0}'.encode()).hexdigest()
+
+
+def claim_payment(booking, amount, defaults):
+    """(payment, created): the payment of the booking and amount created
+    within the idempotency window, or else a new one claimed with defaults.
+    """
+    window = timedelta(seconds=getattr(settings, 'PAYMENT_IDEMPOTENCY_WINDOW', 900))
+    amount = Decimal(amount).quantize(Decimal('0.01'))
+    latest = Payment.objects.filter(
+        booking=booking, amount=amount
+    ).order_by('-created_at', '-pk').first()
+    if latest and latest.created_at >= timezone.now() - window:
+        return latest, False
+    # Requests that both found none race on the unique key; a transaction
+    # around the lookup would not serialize them
+    return Payment.objects.get_or_create(
+        idempotency_key=idempotency_key(booking.pk, amount, latest and latest.pk),
+        defaults={'booking': booking, 'amount': amount, **defaults},
+    )
+
+
+def take_over_stale_claim(payment):
+    """Re-claim a payment whose initiation never stored a checkout_url
+    within PAYMENT_CLAIM_TIMEOUT, under a fresh tx_ref. Returns the payment,
+    or None while the claim is live or another retry took it over first.
+    """
+    timeout = timedelta(seconds=getattr(settings, 'PAYMENT_CLAIM_TIMEOUT', 120))
+    now = timezone.now()
+    if payment.checkout_url or now - payment.updated_at < timeout:
+        return None
+    tx_ref = str(uuid.uuid4())
+    taken = Payment.objects.filter(
+        pk=payment.pk, checkout_url='', updated_at=payment.updated_at
+    ).update(tx_ref=tx_ref, updated_at=now)
+    if not taken:
+        return None
+    payment.tx_ref, payment.updated_at = tx_ref, now
+    return payment
+
+
+def payment_status(data):
+    """Payment.status for the data of a Chapa verify response"""
+    return str(data.get('status') or 'pending').capitalize()
+
+
+async def verify_all(tx_refs, concurrency=10, client=None):
+    """Map each tx_ref to its verify data, or to the ChapaError raised.
+
+    At most concurrency calls are in flight; pass client to reuse its
+    connections across calls.
+    """
+    if client is None:
+        async with AsyncChapaClient(pool_size=concurrency) as client:
+            return await verify_all(tx_refs, concurrency, client)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def verify(tx_ref):
+        async with semaphore:
+            try:
+                return tx_ref, await client.verify(tx_ref)
+            except ChapaError as error:
+                return tx_ref, error
+
+    return dict(await asyncio.gather(*(verify(tx_ref) for tx_ref in tx_refs)))
+
+
+def apply_statuses(statuses):
+    """Bulk-update Payment.status from a {tx_ref: status} map, returning the
+    number of payments changed.
+    """
+    payments = Payment.objects.filter(tx_ref__in=statuses).only('pk', 'tx_ref', 'status')
+    changed = []
+    for payment in payments:
+        if payment.status != statuses[payment.tx_ref]:
+            payment.status = statuses[payment.tx_ref]
+            changed.append(payment)
+    Payment.objects.bulk_update(changed, ['status'])
+    return len(changed)
+
+
+def process_payment_events(batch_size=100, concurrency=10):
+    """Verify one batch of queued events; returns (events processed,
+    payments updated).
+    """
+    events = list(
+        PaymentEvent.objects.filter(processed_at__isnull=True)
+        .order_by('received_at')
+        .values_list('pk', 'tx_ref')[:batch_size]
+    )
+    if not events:
+        return 0, 0
+
+    results = asyncio.run(verify_all({tx_ref for _, tx_ref in events}, concurrency))
+    statuses = {
+        tx_ref: payment_status(data)
+        for tx_ref, data in results.items()
+        if not isinstance(data, ChapaError)
+    }
+    # Unknown transactions are settled; outages are retried next batch
+    done = [
+        pk for pk, tx_ref in events
+        if tx_ref in statuses or not results[tx_ref].unavailable
+    ]
+
+    with transaction.atomic():
+        updated = apply_statuses(statuses)
+        PaymentEvent.objects.filter(pk__in=done).update(processed_at=timezone.now())
+    return len(done), updated
+
+
+def reconcile_pending(after=0, chunk_size=1000, concurrency=10):
+    """Verify Pending payments with a primary key above after, in key order.
+
+    Rows are streamed chunk_size at a time and verified with at most
+    concurrency calls in flight over one connection pool. Payments whose
+    status changed are bulk-updated, then the chunk is yielded as a list of
+    (pk, tx_ref, verify data or ChapaError).
+    """
+    rows = (
+        Payment.objects.filter(status='Pending', tx_ref__isnull=False, pk__gt=after)
+        .order_by('pk')
+        .values_list('pk', 'tx_ref')
+        .iterator(chunk_size=chunk_size)
+    )
+    loop = asyncio.new_event_loop()
+    client = AsyncChapaClient(pool_size=concurrency)
+    try:
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            results = loop.run_until_complete(
+                verify_all([tx_ref for _, tx_ref in chunk], concurrency, client)
+            )
+            changed = []
+            for pk, tx_ref in chunk:
+                result = results[tx_ref]
+                if not isinstance(result, ChapaError) and payment_status(result) != 'Pending':
+                    changed.append(Payment(pk=pk, status=payment_status(result)))
+            Payment.objects.bulk_update(changed, ['status'])
+            yield [(pk, tx_ref, results[tx_ref]) for pk, tx_ref in chunk]
+    finally:
+        loop.run_until_complete(client.close())
+        loop.close()
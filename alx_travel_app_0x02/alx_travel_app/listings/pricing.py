@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Nightly rates and stay quotes.
+
+A listing's calendar is its price_per_night plus the PriceRule rows
+overlapping a stay. The rule boundaries cut the stay into segments in
+which the same rules apply, and within a segment each weekday has a single
+rate, so a quote counts the nights per weekday of each segment instead of
+walking the stay night by night. Its cost depends on the number of rules,
+not on the length of the stay.
+
+Quotes are cached under a per-listing price version, bumped by the Listing
+and PriceRule signal handlers in signals.py, so a quote is never served
+after the listing's price or calendar changes.
+
+Settings:
+    PRICE_QUOTE_TIMEOUT  seconds to keep a quote; 0 disables caching
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+
+from .cache import bump_version, get_cache, get_version
+from .models import Listing, PriceRule
+
+PREFIX = 'listings:quote'
+
+
+def get_timeout():
+    return getattr(settings, 'PRICE_QUOTE_TIMEOUT', 3600)
+
+
+def price_version_key(pk):
+    return f'{PREFIX}:version:{pk}'
+
+
+def bump_prices(pk):
+    """Invalidate every cached quote of a listing"""
+    bump_version(price_version_key(pk), timeout=get_timeout())
+
+
+def nights_by_weekday(start, end):
+    """Number of nights in [start, end) falling on each weekday, Monday first"""
+    weeks, extra = divmod((end - start).days, 7)
+    counts = [weeks] * 7
+    for offset in range(extra):
+        counts[(start.weekday() + offset) % 7] += 1
+    return counts
+
+
+def rules_for_stay(listing_id, check_in, check_out):
+    """Price rules of a listing overlapping [check_in, check_out), in
+    precedence order.
+    """
+    return list(PriceRule.objects.filter(
+        Q(start_date__isnull=True) | Q(start_date__lt=check_out),
+        Q(end_date__isnull=True) | Q(end_date__gt=check_in),
+        listing_id=listing_id,
+    ).order_by('-priority', '-id'))
+
+
+def compute_quote(base_price, rules, check_in, check_out):
+    """Price the nights of [check_in, check_out) at base_price, or at the
+    first rule in rules covering a night.
+    """
+    cuts = {check_in, check_out}
+    for rule in rules:
+        cuts.update(
+            day for day in (rule.start_date, rule.end_date)
+            if day is not None and check_in < day < check_out
+        )
+    cuts = sorted(cuts)
+
+    rates = {}
+    for start, end in zip(cuts, cuts[1:]):
+        # Every rule boundary is a cut, so a rule covers a segment or misses it
+        active = [
+            rule for rule in rules
+            if (rule.start_date is None or rule.start_date <= start)
+            and (rule.end_date is None or rule.end_date >= end)
+        ]
+        for weekday, nights in enumerate(nights_by_weekday(start, end)):
+            if nights:
+                price = next(
+                    (rule.price_per_night for rule in active if rule.applies_on(weekday)),
+                    base_price
+                )
+                rates[price] = rates.get(price, 0) + nights
+
+    nights = (check_out - check_in).days
+    total = sum((price * count for price, count in rates.items()), Decimal('0.00'))
+    return {
+        'check_in': check_in,
+        'check_out': check_out,
+        'nights': nights,
+        'total_price': total,
+        'average_nightly_price': (total / nights).quantize(Decimal('0.01')) if nights else total,
+        'rates': [
+            {'price_per_night': price, 'nights': count}
+            for price, count in sorted(rates.items())
+        ],
+    }
+
+
+def get_quote(listing_id, check_in, check_out, listing=None):
+    """Quote a stay, from the cache when possible. Pass the listing when it
+    is already loaded; otherwise it is read on a cache miss
+    (Listing.DoesNotExist if absent).
+    """
+    timeout = get_timeout()
+    if timeout:
+        # Read the version before the rates so a concurrent change can
+        # only store its result under a version that is already stale
+        version = get_version(price_version_key(listing_id), timeout=timeout)
+        key = f'{PREFIX}:{listing_id}:{version}:{check_in}:{check_out}'
+        quote = get_cache().get(key)
+        if quote is not None:
+            return quote
+
+    if listing is None:
+        listing = Listing.objects.only('price_per_night').get(pk=listing_id)
+    quote = compute_quote(
+        listing.price_per_night, rules_for_stay(listing_id, check_in, check_out),
+        check_in, check_out
+    )
+    if timeout:
+        get_cache().set(key, quote, timeout)
+    return quote
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Review aggregates stored on Listing.
+
+Listing.review_count, rating_total and rating_avg are kept current by the
+Review signal handlers in signals.py. Each review write applies its delta
+in a single UPDATE computed from the stored columns, so concurrent reviews
+of a listing cannot lose each other's changes and no review is ever read
+back. Writes that skip signals (QuerySet.update, bulk_create, raw SQL) are
+repaired with the rebuild_ratings command.
+"""
+
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Listing, Review
+
+
+def apply_review_delta(listing_id, count_delta, rating_delta):
+    """Add count_delta reviews totalling rating_delta to a listing"""
+    count = F('review_count') + count_delta
+    total = F('rating_total') + rating_delta
+    listing = Listing.objects.filter(
+        pk=listing_id, review_count__gte=-count_delta, rating_total__gte=-rating_delta
+    )
+    updated = listing.update(
+        review_count=count,
+        rating_total=total,
+        rating_avg=Case(
+            When(review_count=-count_delta, then=Value(0.0)),
+            default=Cast(total, FloatField()) / count,
+            output_field=FloatField(),
+        ),
+    )
+    if not updated:
+        # The stored aggregates missed reviews written without signals
+        rebuild_ratings(Listing.objects.filter(pk=listing_id))
+
+
+def review_saved(review, created):
+    loaded = getattr(review, '_loaded', None)
+    if created:
+        apply_review_delta(review.listing_id, 1, review.rating)
+    elif loaded is None:
+        # Saved without being loaded first, so the old values are unknown
+        rebuild_ratings(Listing.objects.filter(pk=review.listing_id))
+    else:
+        old_listing_id, old_rating = loaded
+        if old_listing_id != review.listing_id:
+            apply_review_delta(old_listing_id, -1, -old_rating)
+            apply_review_delta(review.listing_id, 1, review.rating)
+        elif old_rating != review.rating:
+            apply_review_delta(review.listing_id, 0, review.rating - old_rating)
+    review._loaded = (review.listing_id, review.rating)
+
+
+def review_deleted(review):
+    listing_id, rating = getattr(review, '_loaded', None) or (review.listing_id, review.rating)
+    apply_review_delta(listing_id, -1, -rating)
+
+
+def rebuild_ratings(queryset=None, batch_size=1000):
+    """Recompute the aggregates of the listings in queryset (default: all)
+    from their reviews, batch_size listings per UPDATE. Returns the number
+    of listings updated.
+    """
+    queryset = Listing.objects.all() if queryset is None else queryset
+    reviews = Review.objects.filter(listing=OuterRef('pk')).order_by().values('listing')
+    count = Coalesce(
+        Subquery(reviews.annotate(n=Count('pk')).values('n')), 0, output_field=IntegerField()
+    )
+    total = Coalesce(
+        Subquery(reviews.annotate(n=Sum('rating')).values('n')), 0, output_field=IntegerField()
+    )
+
+    updated = 0
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    last = None
+    while True:
+        batch = pks.filter(pk__gt=last) if last is not None else pks
+        batch = list(batch[:batch_size])
+        if not batch:
+            return updated
+        Listing.objects.filter(pk__in=batch).update(review_count=count, rating_total=total)
+        Listing.objects.filter(pk__in=batch).update(rating_avg=Case(
+            When(review_count=0, then=Value(0.0)),
+            default=Cast(F('rating_total'), FloatField()) / F('review_count'),
+            output_field=FloatField(),
+        ))
+        updated += len(batch)
+        last = batch[-1]
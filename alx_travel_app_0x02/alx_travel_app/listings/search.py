@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Full-text search index for listings.
+
+The searchable text of every listing is copied into an inverted index next
+to the listings table: an FTS5 virtual table on SQLite, or a tsvector column
+with a GIN index on PostgreSQL. The index is created after migrate, kept
+current by the Listing signal handlers in signals.py and can be rebuilt
+with the rebuild_search_index command. On other databases the search
+filter falls back to the default icontains scan.
+"""
+
+import re
+
+from django.db import connection
+from rest_framework import filters
+
+from .cache import LIST_VERSION_KEY, bump_version
+from .models import Listing
+
+SQLITE_TABLE = 'listings_listing_fts'
+POSTGRES_TABLE = 'listings_listing_search'
+
+# Relative weight of each indexed column, highest first
+SEARCH_COLUMNS = ('title', 'city', 'amenities', 'description')
+SQLITE_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+POSTGRES_WEIGHTS = ('A', 'B', 'B', 'C')
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def ensure_search_index(**kwargs):
+    """Create the index table if it does not exist (post_migrate hook)"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} "
+                f"USING fts5({', '.join(SEARCH_COLUMNS)}, "
+                f"tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+                f"listing_id bigint PRIMARY KEY "
+                f"REFERENCES {Listing._meta.db_table} (id) ON DELETE CASCADE, "
+                f"document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+                f"ON {POSTGRES_TABLE} USING gin (document)"
+            )
+
+
+def searchable_text(listing):
+    return [str(getattr(listing, column) or '') for column in SEARCH_COLUMNS]
+
+
+def index_listings(rows):
+    """Write (pk, title, city, amenities, description) rows to the index"""
+    rows = [tuple(row) for row in rows]
+    if not rows or not is_supported():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(
+                f"DELETE FROM {SQLITE_TABLE} WHERE rowid = %s",
+                [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, {', '.join(SEARCH_COLUMNS)}) "
+                f"VALUES (%s, %s, %s, %s, %s)",
+                rows
+            )
+        else:
+            document = ' || '.join(
+                f"setweight(to_tsvector('simple', %s), '{weight}')"
+                for weight in POSTGRES_WEIGHTS
+            )
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (listing_id, document) "
+                f"VALUES (%s, {document}) "
+                f"ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+
+def unindex_listing(pk):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = %s", [pk])
+    # PostgreSQL rows go away with the listing through ON DELETE CASCADE
+
+
+def rebuild_search_index(batch_size=1000):
+    """Re-index every listing, returning the number of rows written"""
+    ensure_search_index()
+    with connection.cursor() as cursor:
+        table = SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+        cursor.execute(f"DELETE FROM {table}")
+
+    total = 0
+    batch = []
+    rows = Listing.objects.order_by().values_list('pk', *SEARCH_COLUMNS)
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            index_listings(batch)
+            total += len(batch)
+            batch = []
+    index_listings(batch)
+
+    # Search results may change without any listing being written
+    bump_version(LIST_VERSION_KEY)
+    return total + len(batch)
+
+
+def search_queryset(queryset, text):
+    """Restrict queryset to listings matching every term, annotated with
+    a search_rank where higher is more relevant.
+    """
+    terms = TERM_RE.findall(text.lower())
+    if not terms:
+        return queryset
+
+    pk = f'{Listing._meta.db_table}.{Listing._meta.pk.column}'
+    # The index table is joined on the listing id, so the full-text query
+    # runs once and each matching row carries its rank, rather than being
+    # ranked by a correlated subquery per listing
+    if connection.vendor == 'sqlite':
+        # Quoted prefix terms keep user input out of the FTS5 query syntax
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        queryset = queryset.extra(
+            select={'search_rank': f"-bm25({SQLITE_TABLE}, {weights})"},
+            tables=[SQLITE_TABLE],
+            where=[f"{SQLITE_TABLE} MATCH %s", f"{SQLITE_TABLE}.rowid = {pk}"],
+            params=[match],
+        )
+    else:
+        match = ' & '.join(f'{term}:*' for term in terms)
+        queryset = queryset.extra(
+            select={'search_rank': f"ts_rank({POSTGRES_TABLE}.document, to_tsquery('simple', %s))"},
+            select_params=[match],
+            tables=[POSTGRES_TABLE],
+            where=[
+                f"{POSTGRES_TABLE}.document @@ to_tsquery('simple', %s)",
+                f"{POSTGRES_TABLE}.listing_id = {pk}",
+            ],
+            params=[match],
+        )
+    return queryset.order_by('-search_rank')
+
+
+class ListingSearchFilter(filters.SearchFilter):
+    """SearchFilter answering `search` from the full-text index"""
+
+    def filter_queryset(self, request, queryset, view):
+        if not is_supported():
+            return super().filter_queryset(request, queryset, view)
+        text = request.query_params.get(self.search_param, '')
+        return search_queryset(queryset, text)
+
+
+class RelevanceOrderingFilter(filters.OrderingFilter):
+    """OrderingFilter that keeps relevance order for searches made without
+    an explicit ordering parameter, and drops ordering on annotations the
+    request did not produce (distance_km without near).
+    """
+
+    annotation_fields = ('distance_km',)
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        valid = super().remove_invalid_fields(queryset, fields, view, request)
+        return [
+            term for term in valid
+            if term.lstrip('-') not in self.annotation_fields
+            or term.lstrip('-') in queryset.query.annotations
+        ]
+
+    def get_ordering(self, request, queryset, view):
+        text = request.query_params.get(filters.SearchFilter.search_param, '')
+        searching = is_supported() and TERM_RE.search(text)
+        if searching and not request.query_params.get(self.ordering_param):
+            return None
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Fake data generation for the seeds command.
+
+Rows are generated as plain tuples by generate_chunk, which does not touch
+the database or import models, so the seeds command can run it in worker
+processes (including with the spawn start method) while the parent process
+inserts the previous chunk.
+
+Each listing gets its own calendar of bookings laid end to end with random
+gaps, so no two bookings of a listing ever overlap. Chunks are seeded from
+(seed, chunk start), so a given seed always produces the same data however
+many workers produce it.
+"""
+
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from faker import Faker
+
+PROPERTY_TYPES = ('apartment', 'house', 'condo', 'villa', 'studio', 'loft')
+AMENITIES = (
+    'wifi', 'kitchen', 'parking', 'pool', 'air conditioning', 'heating',
+    'washer', 'dryer', 'tv', 'workspace', 'gym', 'hot tub', 'balcony',
+    'breakfast', 'pet friendly', 'sea view',
+)
+ADJECTIVES = ('Cozy', 'Sunny', 'Spacious', 'Modern', 'Quiet', 'Charming', 'Bright', 'Rustic')
+# Calendars start this many days ago so that completed stays exist too
+CALENDAR_DAYS_BACK = 180
+
+_pools = {}
+
+
+def get_pools():
+    """Faker output reused across rows; Faker is far slower than sampling"""
+    if not _pools:
+        faker = Faker()
+        faker.seed_instance(0)
+        _pools.update(
+            places=[
+                (faker.city(), faker.state(), faker.country(), faker.postcode())
+                for _ in range(500)
+            ],
+            streets=[faker.street_address() for _ in range(1000)],
+            descriptions=[faker.paragraph(nb_sentences=4) for _ in range(500)],
+            rules=['', 'No smoking.', 'No parties or events.', 'Quiet hours after 10pm.'],
+        )
+    return _pools
+
+
+def bookings_for(index, total_listings, total_bookings):
+    """Bookings given to the listing at index, spreading total_bookings
+    evenly over total_listings.
+    """
+    return (
+        (index + 1) * total_bookings // total_listings
+        - index * total_bookings // total_listings
+    )
+
+
+def generate_calendar(rnd, count, today):
+    """count (check_in, check_out, status) stays laid end to end"""
+    stays = []
+    day = today - timedelta(days=CALENDAR_DAYS_BACK - rnd.randint(0, 30))
+    for _ in range(count):
+        check_in = day + timedelta(days=rnd.choice((0, 0, 1, 2, 3, 7)))
+        check_out = check_in + timedelta(days=rnd.randint(1, 7))
+        if check_out <= today:
+            status = 'completed' if rnd.random() < 0.9 else 'cancelled'
+        else:
+            status = rnd.choices(('confirmed', 'pending', 'cancelled'), (7, 2, 1))[0]
+        stays.append((check_in, check_out, status))
+        day = check_out
+    return stays
+
+
+def generate_chunk(args):
+    """Generate listings start..start+count-1 and their bookings.
+
+    args is (seed, start, count, total_listings, total_bookings, users).
+    Returns (listings, bookings): listings are (host slot, fields dict,
+    amenity names) and bookings are (listing offset in the chunk, guest
+    slot, check_in, check_out, guests, total price, status), where a slot
+    indexes the users the command created.
+    """
+    seed, start, count, total_listings, total_bookings, users = args
+    rnd = random.Random(f'{seed}:{start}')
+    pools = get_pools()
+    today = date.today()
+    listings = []
+    bookings = []
+
+    for offset in range(count):
+        city, state, country, postal_code = rnd.choice(pools['places'])
+        property_type = rnd.choice(PROPERTY_TYPES)
+        bedrooms = rnd.randint(1, 5)
+        amenities = rnd.sample(AMENITIES, rnd.randint(2, 6))
+        price = Decimal(rnd.randint(2000, 40000)) / 100
+        max_guests = bedrooms * 2
+        listings.append((
+            rnd.randrange(users),
+            {
+                'title': f'{rnd.choice(ADJECTIVES)} {property_type} in {city}',
+                'description': rnd.choice(pools['descriptions']),
+                'property_type': property_type,
+                'price_per_night': price,
+                'bedrooms': bedrooms,
+                'bathrooms': rnd.randint(1, bedrooms),
+                'max_guests': max_guests,
+                'address': rnd.choice(pools['streets']),
+                'city': city,
+                'state': state,
+                'country': country,
+                'postal_code': postal_code,
+                'latitude': Decimal(f'{rnd.uniform(-60, 70):.6f}'),
+                'longitude': Decimal(f'{rnd.uniform(-180, 180):.6f}'),
+                'amenities': ', '.join(amenities),
+                'house_rules': rnd.choice(pools['rules']),
+            },
+            amenities,
+        ))
+
+        count_bookings = bookings_for(start + offset, total_listings, total_bookings)
+        for check_in, check_out, status in generate_calendar(rnd, count_bookings, today):
+            nights = (check_out - check_in).days
+            bookings.append((
+                offset, rnd.randrange(users), check_in, check_out,
+                rnd.randint(1, max_guests), price * nights, status,
+            ))
+
+    return listings, bookings
@@ -1,7 +1,12 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Listing, Booking
+from django.db import transaction
+from .models import Listing, Booking, HostMonthlyStats, PriceRule
+from .availability import lock_listing_calendar, overlapping_bookings
+from .pricing import get_quote
 from django.utils import timezone
+from decimal import Decimal
+from datetime import timedelta
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,6 +18,8 @@ class ListingSerializer(serializers.ModelSerializer):
     host = UserSerializer(read_only=True)
     amenities_list = serializers.ReadOnlyField()
     bookings_count = serializers.SerializerMethodField()
+    distance_km = serializers.FloatField(read_only=True)
+    rating_avg = serializers.SerializerMethodField()
     
     class Meta:
         model = Listing
@@ -21,13 +28,23 @@ class ListingSerializer(serializers.ModelSerializer):
             'bedrooms', 'bathrooms', 'max_guests', 'address', 'city', 'state',
             'country', 'postal_code', 'latitude', 'longitude', 'amenities',
             'amenities_list', 'house_rules', 'status', 'host', 'created_at',
-            'updated_at', 'image', 'bookings_count'
+            'updated_at', 'image', 'bookings_count', 'distance_km',
+            'rating_avg', 'review_count'
+        ]
+        read_only_fields = [
+            'id', 'host', 'created_at', 'updated_at', 'bookings_count', 'review_count'
         ]
-        read_only_fields = ['id', 'host', 'created_at', 'updated_at', 'bookings_count']
 
     def get_bookings_count(self, obj):
+        # Use the annotation from ListingViewSet.get_queryset when present
+        if hasattr(obj, 'bookings_count'):
+            return obj.bookings_count
         return obj.bookings.filter(status__in=['confirmed', 'completed']).count()
 
+    def get_rating_avg(self, obj):
+        # Stored as 0 for listings without reviews
+        return round(obj.rating_avg, 2) if obj.review_count else None
+
     def validate_price_per_night(self, value):
         if value <= 0:
             raise serializers.ValidationError("Price per night must be greater than 0.")
@@ -53,11 +70,53 @@ class ListingCreateSerializer(serializers.ModelSerializer):
         validated_data['host'] = request.user
         return super().create(validated_data)
 
+def expanded_fields(request):
+    """Names listed in the comma-separated ?expand= query parameter"""
+    if request is None:
+        return set()
+    return {name.strip() for name in request.query_params.get('expand', '').split(',')}
+
+class PriceRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PriceRule
+        fields = [
+            'id', 'label', 'start_date', 'end_date', 'weekdays',
+            'price_per_night', 'priority', 'created_at'
+        ]
+        read_only_fields = ['id', 'created_at']
+
+    def validate(self, data):
+        start = data.get('start_date')
+        end = data.get('end_date')
+        if start and end and start >= end:
+            raise serializers.ValidationError("End date must be after start date.")
+        return data
+
+class QuoteRateSerializer(serializers.Serializer):
+    price_per_night = serializers.DecimalField(max_digits=10, decimal_places=2)
+    nights = serializers.IntegerField()
+
+class QuoteSerializer(serializers.Serializer):
+    listing_id = serializers.IntegerField()
+    check_in = serializers.DateField()
+    check_out = serializers.DateField()
+    nights = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2)
+    average_nightly_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    rates = QuoteRateSerializer(many=True)
+    available = serializers.BooleanField()
+
+class ListingSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Listing
+        fields = ['id', 'title', 'city', 'country', 'property_type', 'price_per_night', 'image']
+        read_only_fields = fields
+
 class BookingSerializer(serializers.ModelSerializer):
-    listing = ListingSerializer(read_only=True)
+    listing = ListingSummarySerializer(read_only=True)
     guest = UserSerializer(read_only=True)
     duration_days = serializers.ReadOnlyField()
-    listing_id = serializers.IntegerField(write_only=True)
+    listing_id = serializers.IntegerField()
     
     class Meta:
         model = Booking
@@ -68,6 +127,12 @@ class BookingSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'guest', 'total_price', 'created_at', 'updated_at']
 
+    def get_fields(self):
+        fields = super().get_fields()
+        if 'listing' in expanded_fields(self.context.get('request')):
+            fields['listing'] = ListingSerializer(read_only=True)
+        return fields
+
     def validate(self, data):
         check_in = data.get('check_in_date')
         check_out = data.get('check_out_date')
@@ -79,35 +144,83 @@ class BookingSerializer(serializers.ModelSerializer):
             if check_in < timezone.now().date():
                 raise serializers.ValidationError("Check-in date cannot be in the past.")
         
-        # Validate guests count against listing capacity
+        # Validate guests count against listing capacity; new bookings are
+        # checked in create() while the listing is locked
         listing_id = data.get('listing_id')
         guests_count = data.get('guests_count')
         
-        if listing_id and guests_count:
+        if self.instance is not None and listing_id and guests_count:
             try:
                 listing = Listing.objects.get(id=listing_id)
-                if guests_count > listing.max_guests:
-                    raise serializers.ValidationError(
-                        f"Number of guests ({guests_count}) exceeds listing capacity ({listing.max_guests})."
-                    )
             except Listing.DoesNotExist:
                 raise serializers.ValidationError("Invalid listing ID.")
+            self.validate_capacity(listing, guests_count)
         
         return data
 
+    def validate_capacity(self, listing, guests_count):
+        if guests_count > listing.max_guests:
+            raise serializers.ValidationError(
+                f"Number of guests ({guests_count}) exceeds listing capacity ({listing.max_guests})."
+            )
+
     def create(self, validated_data):
         request = self.context.get('request')
         listing_id = validated_data.pop('listing_id')
-        listing = Listing.objects.get(id=listing_id)
-        
-        # Calculate total price
         check_in = validated_data['check_in_date']
         check_out = validated_data['check_out_date']
-        duration = (check_out - check_in).days
-        total_price = listing.price_per_night * duration
-        
-        validated_data['guest'] = request.user
-        validated_data['listing'] = listing
-        validated_data['total_price'] = total_price
         
-        return super().create(validated_data)
\ No newline at end of file
+        # Lock the listing's calendar so that concurrent requests for the
+        # same dates cannot both pass the overlap check
+        with transaction.atomic():
+            try:
+                listing = lock_listing_calendar(listing_id)
+            except Listing.DoesNotExist:
+                raise serializers.ValidationError("Invalid listing ID.")
+            self.validate_capacity(listing, validated_data['guests_count'])
+            
+            if overlapping_bookings(listing.pk, check_in, check_out).exists():
+                raise serializers.ValidationError(
+                    "The listing is already booked for some of these dates."
+                )
+            
+            # Price the stay from the listing's rate calendar
+            quote = get_quote(listing.pk, check_in, check_out, listing=listing)
+            validated_data['total_price'] = quote['total_price']
+            validated_data['guest'] = request.user
+            validated_data['listing'] = listing
+            
+            return super().create(validated_data)
+
+
+class HostMonthlyStatsSerializer(serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m', read_only=True)
+    occupancy_rate = serializers.SerializerMethodField()
+
+    class Meta:
+        model = HostMonthlyStats
+        fields = [
+            'month', 'pending_bookings', 'confirmed_bookings', 'cancelled_bookings',
+            'completed_bookings', 'booked_nights', 'revenue', 'occupancy_rate'
+        ]
+        read_only_fields = fields
+
+    def get_occupancy_rate(self, obj):
+        # Booked share of the nights the host's current listings offer
+        listings = self.context.get('listings_count')
+        if not listings:
+            return None
+        days = (obj.month.replace(day=28) + timedelta(days=4)).replace(day=1) - obj.month
+        return round(obj.booked_nights / (listings * days.days), 4)
+
+
+class PaymentInitiateSerializer(serializers.Serializer):
+    """Input of InitiatePaymentView; amount defaults to the booking total"""
+    booking = serializers.PrimaryKeyRelatedField(queryset=Booking.objects.all())
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'), required=False)
+    email = serializers.EmailField()
+    full_name = serializers.CharField(max_length=255)
+
+    def validate(self, data):
+        data.setdefault('amount', data['booking'].total_price)
+        return data
@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Listing, Booking, PriceRule, Review
+from .availability import availability_index
+from .search import index_listings, searchable_text, unindex_listing
+from .cache import bump_listing
+from .ratings import review_deleted, review_saved
+from .pricing import bump_prices
+from . import host_stats
+
+
+@receiver(post_save, sender=Booking)
+def index_saved_booking(sender, instance, **kwargs):
+    span = (instance.pk, instance.listing_id, instance.status,
+            instance.check_in_date, instance.check_out_date)
+    # A booking moved to another listing also leaves its old calendar
+    previous_listing_id = getattr(instance, '_loaded', (None,))[0]
+    transaction.on_commit(lambda: availability_index.booking_saved(
+        *span, previous_listing_id=previous_listing_id
+    ))
+
+
+@receiver(post_save, sender=Booking)
+def update_host_stats(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        host_stats.booking_saved(instance, created)
+
+
+@receiver(post_delete, sender=Booking)
+def remove_host_stats(sender, instance, **kwargs):
+    host_stats.booking_deleted(instance)
+
+
+@receiver(post_delete, sender=Booking)
+def unindex_deleted_booking(sender, instance, **kwargs):
+    booking_id, listing_id = instance.pk, instance.listing_id
+    transaction.on_commit(lambda: availability_index.booking_deleted(booking_id, listing_id))
+
+
+@receiver(post_delete, sender=Listing)
+def unindex_deleted_listing(sender, instance, **kwargs):
+    listing_id = instance.pk
+    transaction.on_commit(lambda: availability_index.listing_deleted(listing_id))
+    transaction.on_commit(lambda: unindex_listing(listing_id))
+
+
+@receiver(post_save, sender=Listing)
+def sync_listing_amenities(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'amenities' in update_fields:
+        instance.sync_amenities()
+
+
+@receiver(post_save, sender=Listing)
+def index_saved_listing(sender, instance, **kwargs):
+    row = (instance.pk, *searchable_text(instance))
+    transaction.on_commit(lambda: index_listings([row]))
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_cached_listing(sender, instance, **kwargs):
+    invalidate_listing_responses(instance.pk)
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def invalidate_cached_booking_listing(sender, instance, **kwargs):
+    invalidate_listing_responses(instance.listing_id)
+
+
+def invalidate_listing_responses(listing_id):
+    # Bump now so reads later in this transaction miss, and again on commit
+    # so responses cached by other requests before the commit are dropped
+    bump_listing(listing_id)
+    transaction.on_commit(lambda: bump_listing(listing_id))
+
+
+@receiver(post_save, sender=Review)
+def update_listing_rating(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    review_saved(instance, created)
+    invalidate_listing_responses(instance.listing_id)
+
+
+@receiver(post_delete, sender=Review)
+def remove_listing_rating(sender, instance, **kwargs):
+    review_deleted(instance)
+    invalidate_listing_responses(instance.listing_id)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_quotes(sender, instance, **kwargs):
+    invalidate_quotes(instance.pk)
+
+
+@receiver(post_save, sender=PriceRule)
+@receiver(post_delete, sender=PriceRule)
+def invalidate_price_rule_quotes(sender, instance, **kwargs):
+    invalidate_quotes(instance.listing_id)
+
+
+def invalidate_quotes(listing_id):
+    # Same two bumps as invalidate_listing_responses
+    bump_prices(listing_id)
+    transaction.on_commit(lambda: bump_prices(listing_id))
@@ -1,8 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ListingViewSet, BookingViewSet
-from django.urls import path
-from listings.views import InitiatePaymentView, VerifyPaymentView
+from .views import (
+    ListingViewSet, BookingViewSet, HostStatsView,
+    InitiatePaymentView, VerifyPaymentView, PaymentWebhookView
+)
 # Create a router and register our viewsets
 router = DefaultRouter()
 router.register(r'listings', ListingViewSet, basename='listing')
@@ -12,8 +13,8 @@ app_name = 'listings'
 
 urlpatterns = [
     path('', include(router.urls)),
-]
-urlpatterns = [
+    path('hosts/me/stats/', HostStatsView.as_view(), name='host-stats'),
     path('initiate-payment/', InitiatePaymentView.as_view(), name='initiate-payment'),
     path('verify-payment/', VerifyPaymentView.as_view(), name='verify-payment'),
+    path('payment-webhook/', PaymentWebhookView.as_view(), name='payment-webhook'),
 ]
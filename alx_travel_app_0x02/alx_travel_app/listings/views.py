@@ -1,17 +1,44 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
-from django.db.models import Q
-from .models import Listing, Booking
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_date
+from .models import Listing, Booking, HostMonthlyStats, PriceRule
 from .serializers import (
     ListingSerializer, ListingCreateSerializer,
-    BookingSerializer
+    BookingSerializer, HostMonthlyStatsSerializer, PriceRuleSerializer, QuoteSerializer,
+    expanded_fields
 )
 from .filters import ListingFilter, BookingFilter
+from .availability import availability_index, lock_booking
+from .host_stats import FIELDS as STAT_FIELDS
+from .pricing import get_quote
+from .search import ListingSearchFilter, RelevanceOrderingFilter
+from .pagination import KeysetPagination
+from . import cache as response_cache
+
+def listing_queryset():
+    """Listings with everything ListingSerializer reads loaded up front"""
+    # Join the host, count bookings and prefetch amenities once per page
+    # so that serializing does not issue per-listing queries. The count
+    # is a correlated subquery rather than a JOIN + GROUP BY so that a
+    # page can still be read straight off the (created_at, id) index.
+    bookings_count = Booking.objects.filter(
+        listing=OuterRef('pk'), status__in=['confirmed', 'completed']
+    ).order_by().values('listing').annotate(count=Count('pk')).values('count')
+    return Listing.objects.select_related('host').prefetch_related(
+        'amenity_set'
+    ).annotate(
+        bookings_count=Coalesce(Subquery(bookings_count), 0)
+    )
 
 class ListingViewSet(viewsets.ModelViewSet):
     """
@@ -21,9 +48,13 @@ class ListingViewSet(viewsets.ModelViewSet):
     """
     queryset = Listing.objects.all()
     permission_classes = [IsAuthenticatedOrReadOnly]
+    filter_backends = [DjangoFilterBackend, ListingSearchFilter, RelevanceOrderingFilter]
+    pagination_class = KeysetPagination
     filterset_class = ListingFilter
     search_fields = ['title', 'description', 'city', 'amenities']
-    ordering_fields = ['created_at', 'price_per_night', 'title']
+    ordering_fields = [
+        'created_at', 'price_per_night', 'title', 'distance_km', 'rating_avg', 'review_count'
+    ]
     ordering = ['-created_at']
 
     def get_serializer_class(self):
@@ -42,7 +73,7 @@ class ListingViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
 
     def get_queryset(self):
-        queryset = Listing.objects.all()
+        queryset = listing_queryset()
         
         # Filter by current user's listings if requested
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -76,6 +107,12 @@ class ListingViewSet(viewsets.ModelViewSet):
                 required=False,
                 type=OpenApiTypes.NUMBER,
             ),
+            OpenApiParameter(
+                name='min_rating',
+                description='Minimum average review rating; use ordering=-rating_avg to sort by rating',
+                required=False,
+                type=OpenApiTypes.NUMBER,
+            ),
             OpenApiParameter(
                 name='city',
                 description='Filter by city (case-insensitive partial match)',
@@ -84,14 +121,49 @@ class ListingViewSet(viewsets.ModelViewSet):
             ),
             OpenApiParameter(
                 name='search',
-                description='Search in title, description, city, and amenities',
+                description='Full-text search in title, description, city, and amenities, ranked by relevance',
+                required=False,
+                type=str,
+            ),
+            OpenApiParameter(
+                name='amenities',
+                description='Comma-separated amenities the listing must all have, e.g. wifi,pool',
+                required=False,
+                type=str,
+            ),
+            OpenApiParameter(
+                name='near',
+                description='Only listings within radius_km of this point, given as lat,lng',
                 required=False,
                 type=str,
             ),
+            OpenApiParameter(
+                name='radius_km',
+                description='Search radius in kilometres around near; '
+                            'use ordering=distance_km to sort by distance',
+                required=False,
+                type=OpenApiTypes.NUMBER,
+            ),
+            OpenApiParameter(
+                name='check_in',
+                description='Only listings free from this date (requires check_out)',
+                required=False,
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='check_out',
+                description='Only listings free until this date (requires check_in)',
+                required=False,
+                type=OpenApiTypes.DATE,
+            ),
         ]
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        return response_cache.cached_response(
+            request,
+            lambda: response_cache.list_key(request),
+            lambda: super(ListingViewSet, self).list(request, *args, **kwargs)
+        )
 
     @extend_schema(
         summary="Create a new listing",
@@ -105,7 +177,11 @@ class ListingViewSet(viewsets.ModelViewSet):
         description="Get detailed information about a specific listing.",
     )
     def retrieve(self, request, *args, **kwargs):
-        return super().retrieve(request, *args, **kwargs)
+        return response_cache.cached_response(
+            request,
+            lambda: response_cache.detail_key(request, kwargs['pk']),
+            lambda: super(ListingViewSet, self).retrieve(request, *args, **kwargs)
+        )
 
     @extend_schema(
         summary="Update a listing",
@@ -128,6 +204,15 @@ class ListingViewSet(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @extend_schema(
+        summary="Listing response cache statistics",
+        description="Hit and miss counters of the anonymous listing response cache.",
+    )
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        """Report listing response cache hits and misses"""
+        return Response(response_cache.stats())
+
     @extend_schema(
         summary="Get user's listings",
         description="Retrieve all listings belonging to the authenticated user.",
@@ -135,7 +220,7 @@ class ListingViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my_listings(self, request):
         """Get current user's listings"""
-        listings = self.queryset.filter(host=request.user)
+        listings = self.get_queryset().filter(host=request.user)
         page = self.paginate_queryset(listings)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -155,7 +240,10 @@ class ListingViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def availability(self, request, pk=None):
         """Check listing availability for given dates"""
-        listing = self.get_object()
+        # Look the listing up directly: the check_in/check_out list filter
+        # would otherwise hide a listing that is booked for these dates
+        listing = get_object_or_404(Listing, pk=pk)
+        self.check_object_permissions(request, listing)
         check_in = request.query_params.get('check_in')
         check_out = request.query_params.get('check_out')
         
@@ -165,21 +253,96 @@ class ListingViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check for overlapping bookings
-        overlapping_bookings = Booking.objects.filter(
-            listing=listing,
-            status__in=['confirmed', 'pending'],
-            check_in_date__lt=check_out,
-            check_out_date__gt=check_in
-        )
+        try:
+            check_in = parse_date(check_in)
+            check_out = parse_date(check_out)
+        except ValueError:
+            check_in = check_out = None
+        if not check_in or not check_out:
+            return Response(
+                {'error': 'check_in and check_out must be valid dates (YYYY-MM-DD)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        is_available = not overlapping_bookings.exists()
+        # Count overlapping active bookings from the in-process interval index
+        conflicting = availability_index.conflicts(listing.pk, check_in, check_out)
         
         return Response({
-            'available': is_available,
-            'conflicting_bookings': overlapping_bookings.count()
+            'available': conflicting == 0,
+            'conflicting_bookings': conflicting
         })
 
+    @extend_schema(
+        summary="Quote a stay",
+        description="Price a stay at a listing from its nightly rates and price rules.",
+        parameters=[
+            OpenApiParameter('check_in', OpenApiTypes.DATE, required=True),
+            OpenApiParameter('check_out', OpenApiTypes.DATE, required=True),
+        ],
+        responses=QuoteSerializer,
+    )
+    @action(detail=True, methods=['get'])
+    def quote(self, request, pk=None):
+        """Price a stay without booking it"""
+        try:
+            check_in = parse_date(request.query_params.get('check_in', ''))
+            check_out = parse_date(request.query_params.get('check_out', ''))
+        except ValueError:
+            check_in = check_out = None
+        if not check_in or not check_out or check_in >= check_out:
+            return Response(
+                {'error': 'check_in and check_out must be valid dates (YYYY-MM-DD), '
+                          'with check_out after check_in'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Cached quotes need no query; a miss reads the listing and its rules
+        try:
+            quote = get_quote(int(pk), check_in, check_out)
+        except (ValueError, Listing.DoesNotExist):
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response(QuoteSerializer({
+            **quote,
+            'listing_id': int(pk),
+            'available': availability_index.is_available(int(pk), check_in, check_out),
+        }).data)
+
+    @extend_schema(
+        summary="Listing price rules",
+        description="List the price rules of a listing, or add one (host only).",
+        request=PriceRuleSerializer,
+        responses=PriceRuleSerializer(many=True),
+    )
+    @action(detail=True, methods=['get', 'post'])
+    def price_rules(self, request, pk=None):
+        """List or add nightly rate overrides"""
+        if request.method == 'GET':
+            listing = get_object_or_404(Listing, pk=pk)
+            return Response(PriceRuleSerializer(listing.price_rules.all(), many=True).data)
+
+        listing = get_object_or_404(Listing, pk=pk, host=request.user)
+        serializer = PriceRuleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(listing=listing)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @extend_schema(
+        summary="Delete a price rule",
+        description="Remove a price rule from a listing (host only).",
+    )
+    @action(
+        detail=True, methods=['delete'], url_path=r'price_rules/(?P<rule_id>\d+)',
+        permission_classes=[IsAuthenticated]
+    )
+    def delete_price_rule(self, request, pk=None, rule_id=None):
+        """Remove a nightly rate override"""
+        rule = get_object_or_404(
+            PriceRule, pk=rule_id, listing_id=pk, listing__host=request.user
+        )
+        rule.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class BookingViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing bookings.
@@ -189,6 +352,8 @@ class BookingViewSet(viewsets.ModelViewSet):
     queryset = Booking.objects.all()
     serializer_class = BookingSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    pagination_class = KeysetPagination
     filterset_class = BookingFilter
     ordering_fields = ['created_at', 'check_in_date', 'check_out_date']
     ordering = ['-created_at']
@@ -198,14 +363,27 @@ class BookingViewSet(viewsets.ModelViewSet):
         user = self.request.user
         
         # Users can see bookings where they are either the guest or the host
-        return Booking.objects.filter(
+        queryset = Booking.objects.filter(
             Q(guest=user) | Q(listing__host=user)
         )
+        
+        # The full nested listing is only loaded when asked for
+        if 'listing' in expanded_fields(self.request):
+            return queryset.select_related('guest').prefetch_related(
+                Prefetch('listing', queryset=listing_queryset())
+            )
+        return queryset.select_related('listing__host', 'guest')
 
     @extend_schema(
         summary="List user's bookings",
         description="Retrieve all bookings where the user is either the guest or the host of the listing.",
         parameters=[
+            OpenApiParameter(
+                name='expand',
+                description='Use expand=listing to embed the full listing instead of its summary',
+                required=False,
+                type=str,
+            ),
             OpenApiParameter(
                 name='status',
                 description='Filter by booking status',
@@ -260,20 +438,25 @@ class BookingViewSet(viewsets.ModelViewSet):
         """Cancel a booking"""
         booking = self.get_object()
         
-        if booking.status == 'cancelled':
-            return Response(
-                {'error': 'Booking is already cancelled'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if booking.status == 'completed':
-            return Response(
-                {'error': 'Cannot cancel a completed booking'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        booking.status = 'cancelled'
-        booking.save()
+        # Lock and re-read the booking so that concurrent transitions are
+        # applied, and counted in the host's statistics, one at a time
+        with transaction.atomic():
+            booking = lock_booking(booking.pk)
+            
+            if booking.status == 'cancelled':
+                return Response(
+                    {'error': 'Booking is already cancelled'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            if booking.status == 'completed':
+                return Response(
+                    {'error': 'Cannot cancel a completed booking'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            booking.status = 'cancelled'
+            booking.save()
         
         serializer = self.get_serializer(booking)
         return Response(serializer.data)
@@ -294,73 +477,186 @@ class BookingViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if booking.status != 'pending':
-            return Response(
-                {'error': 'Only pending bookings can be confirmed'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        booking.status = 'confirmed'
-        booking.save()
+        with transaction.atomic():
+            booking = lock_booking(booking.pk)
+            
+            if booking.status != 'pending':
+                return Response(
+                    {'error': 'Only pending bookings can be confirmed'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            booking.status = 'confirmed'
+            booking.save()
         
         serializer = self.get_serializer(booking)
         return Response(serializer.data)
+
+class HostStatsView(APIView):
+    """
+    Booking statistics of the authenticated host, read from the
+    HostMonthlyStats rows kept current by host_stats.py.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Host dashboard statistics",
+        description="Bookings by status, booked nights and revenue, in total and for the latest months.",
+        parameters=[
+            OpenApiParameter('months', OpenApiTypes.INT, required=False,
+                             description='Number of latest months to return (default 12)'),
+        ]
+    )
+    def get(self, request):
+        try:
+            months = min(max(int(request.query_params.get('months', 12)), 1), 120)
+        except ValueError:
+            return Response(
+                {'error': 'months must be a number'}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rows = HostMonthlyStats.objects.filter(host=request.user)
+        sums = rows.aggregate(*(Sum(field) for field in STAT_FIELDS))
+        totals = {field: sums[f'{field}__sum'] or 0 for field in STAT_FIELDS}
+        listings_count = Listing.objects.filter(host=request.user).count()
+        serializer = HostMonthlyStatsSerializer(
+            rows.order_by('-month')[:months], many=True,
+            context={'listings_count': listings_count}
+        )
+        return Response({
+            'listings_count': listings_count,
+            'totals': {**totals, 'revenue': f"{totals['revenue']:.2f}"},
+            'months': serializer.data,
+        })
+import hashlib
+import hmac
 import uuid
-import requests
 from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Payment
+from rest_framework.permissions import AllowAny
+from .models import Payment, PaymentEvent
+from .chapa import ChapaError, get_client
+from .payments import claim_payment, payment_status, take_over_stale_claim
+from .serializers import PaymentInitiateSerializer
+
+
+def gateway_error_status(error):
+    if error.unavailable:
+        return status.HTTP_502_BAD_GATEWAY
+    return status.HTTP_400_BAD_REQUEST
+
 
 class InitiatePaymentView(APIView):
+    """
+    Start a Chapa checkout for a booking. Repeats of the same booking and
+    amount within the idempotency window of the last payment return its
+    checkout_url.
+    """
     def post(self, request):
-        tx_ref = str(uuid.uuid4())
+        serializer = PaymentInitiateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        booking = serializer.validated_data["booking"]
+        amount = serializer.validated_data["amount"]
+        full_name = serializer.validated_data["full_name"]
+        email = serializer.validated_data["email"]
+
+        # Claim the payment before calling Chapa; the unique key lets
+        # exactly one of several concurrent duplicates through
+        payment, created = claim_payment(booking, amount, {
+            "booking_reference": str(booking.pk),
+            "full_name": full_name,
+            "email": email,
+            "tx_ref": str(uuid.uuid4()),
+            "status": "Pending",
+        })
+        if not created and payment.checkout_url:
+            return Response({"checkout_url": payment.checkout_url, "tx_ref": payment.tx_ref})
+        if not created and take_over_stale_claim(payment) is None:
+            return self.in_progress()
+
+        names = full_name.split()
         payload = {
-            "amount": request.data.get("amount"),
+            "amount": str(amount),
             "currency": "ETB",
-            "email": request.data.get("email"),
-            "first_name": request.data.get("full_name").split()[0],
-            "last_name": request.data.get("full_name").split()[-1],
-            "tx_ref": tx_ref,
-            "callback_url": "http://localhost:8000/api/verify-payment/",
+            "email": email,
+            "first_name": names[0],
+            "last_name": names[-1],
+            "tx_ref": payment.tx_ref,
+            "callback_url": request.build_absolute_uri(reverse("listings:payment-webhook")),
             "return_url": "http://localhost:8000/payment-success/",
             "customization[title]": "Travel Booking Payment"
         }
 
-        headers = {
-            "Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}"
-        }
+        try:
+            data = get_client().initialize(payload)
+        except ChapaError as error:
+            # Release the key so that the client can retry, unless the claim
+            # went stale and another request has taken it over
+            Payment.objects.filter(pk=payment.pk, tx_ref=payment.tx_ref).delete()
+            return Response({"error": "Payment initiation failed"}, status=gateway_error_status(error))
 
-        chapa_url = "https://api.chapa.co/v1/transaction/initialize"
-        response = requests.post(chapa_url, json=payload, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()["data"]
-            Payment.objects.create(
-                full_name=request.data.get("full_name"),
-                email=request.data.get("email"),
-                amount=request.data.get("amount"),
-                tx_ref=tx_ref,
-                status="Pending"
-            )
-            return Response({"checkout_url": data["checkout_url"]})
-        else:
-            return Response({"error": "Payment initiation failed"}, status=status.HTTP_400_BAD_REQUEST)
+        stored = Payment.objects.filter(pk=payment.pk, tx_ref=payment.tx_ref).update(
+            checkout_url=data["checkout_url"], updated_at=timezone.now()
+        )
+        if not stored:
+            # Taken over: the session started here is not the payment's
+            return self.in_progress()
+        return Response({"checkout_url": data["checkout_url"], "tx_ref": payment.tx_ref})
+
+    def in_progress(self):
+        return Response(
+            {"error": "Payment initiation already in progress"},
+            status=status.HTTP_409_CONFLICT,
+            headers={"Retry-After": "1"}
+        )
 
 class VerifyPaymentView(APIView):
     def get(self, request):
         tx_ref = request.query_params.get("tx_ref")
-        url = f"https://api.chapa.co/v1/transaction/verify/{tx_ref}"
-        headers = {
-            "Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}"
-        }
+        if not tx_ref:
+            return Response({"error": "tx_ref is required"}, status=status.HTTP_400_BAD_REQUEST)
+        # Unknown references never reach Chapa or use up its retries
+        payment = get_object_or_404(Payment, tx_ref=tx_ref)
+        try:
+            data = get_client().verify(tx_ref)
+        except ChapaError as error:
+            return Response({"error": "Verification failed"}, status=gateway_error_status(error))
+
+        payment.status = payment_status(data)
+        payment.save()
+        return Response({"message": "Payment verified", "status": payment.status})
+
+class PaymentWebhookView(APIView):
+    """
+    Chapa webhook (POST) and callback (GET) receiver. Notifications are only
+    queued here; the process_payment_events worker verifies them.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        secret = getattr(settings, "CHAPA_WEBHOOK_SECRET", None)
+        if secret:
+            expected = hmac.new(secret.encode(), request.body, hashlib.sha256).hexdigest()
+            signature = request.headers.get("X-Chapa-Signature", "")
+            if not hmac.compare_digest(expected, signature):
+                return Response({"error": "Invalid signature"}, status=status.HTTP_401_UNAUTHORIZED)
+        data = request.data
+        return self.queue(data.dict() if hasattr(data, "dict") else data)
+
+    def get(self, request):
+        return self.queue(request.query_params.dict())
 
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()["data"]
-            payment = Payment.objects.get(tx_ref=tx_ref)
-            payment.status = data["status"].capitalize()
-            payment.save()
-            return Response({"message": "Payment verified", "status": payment.status})
-        return Response({"error": "Verification failed"}, status=status.HTTP_400_BAD_REQUEST)
+    def queue(self, payload):
+        if not isinstance(payload, dict):
+            payload = {}
+        # Chapa names the reference trx_ref in callbacks
+        tx_ref = payload.get("tx_ref") or payload.get("trx_ref")
+        if not tx_ref:
+            return Response({"error": "tx_ref is required"}, status=status.HTTP_400_BAD_REQUEST)
+        PaymentEvent.objects.create(tx_ref=str(tx_ref)[:100], payload=payload)
+        return Response({"message": "Event received"})
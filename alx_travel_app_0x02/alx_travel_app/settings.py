@@ -14,6 +14,18 @@ from pathlib import Path
 import os
 
 CHAPA_SECRET_KEY = os.getenv('CHAPA_SECRET_KEY')
+# Verifies the X-Chapa-Signature of webhooks when set
+CHAPA_WEBHOOK_SECRET = os.getenv('CHAPA_WEBHOOK_SECRET')
+# Point at `python manage.py fake_chapa` to work offline
+CHAPA_BASE_URL = os.getenv('CHAPA_BASE_URL', 'https://api.chapa.co/v1')
+CHAPA_TIMEOUT = (3.05, 10)
+CHAPA_MAX_RETRIES = 3
+# Repeated initiations of a booking payment within this many seconds of the
+# last one reuse its checkout session
+PAYMENT_IDEMPOTENCY_WINDOW = 15 * 60
+# An initiation claim with no checkout_url after this many seconds is taken
+# over by the next retry (longer than CHAPA_TIMEOUT with its retries)
+PAYMENT_CLAIM_TIMEOUT = 120
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -129,3 +141,11 @@ INSTALLED_APPS = [
     'drf_yasg',
     'listings',
 ]
+
+# Anonymous listing responses are cached for this many seconds (0 disables).
+# Use a shared cache backend in CACHES when running several workers.
+LISTING_CACHE_TIMEOUT = 300
+
+# Stay quotes are cached for this many seconds (0 disables); price and
+# price rule changes invalidate them.
+PRICE_QUOTE_TIMEOUT = 60 * 60
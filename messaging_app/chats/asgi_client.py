@@ -0,0 +1,57 @@
+"""In-process WebSocket client for ASGI applications.
+
+Drives an ASGI application through the WebSocket protocol events without a
+server or a network socket, for the tests and the ws_loadtest command.
+"""
+
+import asyncio
+import time
+
+
+class WebSocketClient:
+    def __init__(self, application, path, headers=()):
+        self.application = application
+        self.scope = {
+            'type': 'websocket',
+            'asgi': {'version': '3.0'},
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+            'subprotocols': [],
+        }
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        self.task = None
+        self.close_code = None
+        self.received_at = None
+
+    async def connect(self):
+        """Open the connection; True if the application accepted it"""
+        self.task = asyncio.ensure_future(
+            self.application(self.scope, self.inbox.get, self.send)
+        )
+        await self.inbox.put({'type': 'websocket.connect'})
+        event = await self.outbox.get()
+        if event['type'] == 'websocket.accept':
+            return True
+        self.close_code = event.get('code')
+        await self.task
+        return False
+
+    async def send(self, event):
+        # Called by the application
+        self.received_at = time.perf_counter()
+        await self.outbox.put(event)
+
+    async def receive_text(self, timeout=None):
+        """The next text frame, or None once the application closed"""
+        event = await asyncio.wait_for(self.outbox.get(), timeout)
+        if event['type'] == 'websocket.close':
+            self.close_code = event.get('code')
+            return None
+        return event['text']
+
+    async def disconnect(self, code=1000):
+        await self.inbox.put({'type': 'websocket.disconnect', 'code': code})
+        await self.task
@@ -0,0 +1,170 @@
+"""Per-participant inbox rows (InboxEntry) kept in step with messages.
+
+The signal handlers in signals.py call in here: joining a conversation
+creates the participant's row, every new message (or batch of bulk
+imported ones, see ingest.py) updates the rows of the whole conversation
+in a single UPDATE, and reading a conversation resets the reader's unread
+count. GET /api/inbox/ then reads one user's rows off
+the (user, last_activity_at) index without touching the messages table.
+
+Writes that bypass signals (QuerySet.update, bulk_create, raw SQL) leave
+the rows behind; rebuild_inbox, also run by the rebuild_inbox command,
+recomputes them from the messages.
+"""
+
+from collections import defaultdict
+
+from django.db.models import (
+    Case, Count, DateTimeField, Exists, F, OuterRef, PositiveIntegerField, Q, Subquery,
+    Value, When,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Conversation, InboxEntry, Message
+
+Participant = Conversation.participants.through
+
+
+def latest_message(conversation):
+    """Subquery of the newest message of the conversation in OuterRef(conversation)"""
+    return Message.objects.filter(
+        conversation_id=OuterRef(conversation)
+    ).order_by('-sent_at', '-pk')
+
+
+def add_participants(conversation_id, user_ids):
+    """Create the inbox rows of users who joined a conversation.
+
+    The history from before they joined counts as read.
+    """
+    latest = Message.objects.filter(conversation_id=conversation_id).order_by('-sent_at', '-pk').first()
+    now = timezone.now()
+    InboxEntry.objects.bulk_create([
+        InboxEntry(
+            user_id=user_id, conversation_id=conversation_id, last_message=latest,
+            last_activity_at=latest.sent_at if latest else now, last_read_at=now,
+        )
+        for user_id in user_ids
+    ], ignore_conflicts=True)
+
+
+def message_created(message):
+    """Record a new message in the inbox of every participant"""
+    sent_at = Value(message.sent_at, output_field=DateTimeField())
+    by_sender = Q(user_id=message.sender_id)
+    InboxEntry.objects.filter(conversation_id=message.conversation_id).update(
+        # Messages committed out of order never move the inbox back
+        last_message=Case(
+            When(last_activity_at__lte=message.sent_at, then=Value(message.pk)),
+            default=F('last_message'),
+        ),
+        last_activity_at=Greatest('last_activity_at', sent_at),
+        # Sending a message reads the conversation up to it
+        unread_count=Case(When(by_sender, then=Value(0)), default=F('unread_count') + 1),
+        last_read_at=Case(When(by_sender, then=sent_at), default=F('last_read_at')),
+    )
+
+
+def messages_created(messages):
+    """Record a batch of new messages (bulk_create sends no post_save) in
+    the inbox of their participants: one read of the rows involved, then
+    one UPDATE per conversation.
+
+    Unlike message_created, senders are not marked read: each row gains
+    the messages from others sent after its last_read_at, which is what
+    rebuild_inbox would count.
+    """
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_id].append(message)
+
+    unread = defaultdict(dict)
+    entries = InboxEntry.objects.filter(conversation_id__in=list(by_conversation)).values_list(
+        'conversation_id', 'user_id', 'last_read_at'
+    )
+    for conversation_id, user_id, last_read_at in entries:
+        count = sum(
+            1 for message in by_conversation[conversation_id]
+            if message.sender_id != user_id and (last_read_at is None or message.sent_at > last_read_at)
+        )
+        if count:
+            unread[conversation_id][user_id] = count
+
+    for conversation_id, batch in by_conversation.items():
+        latest = max(batch, key=lambda message: (message.sent_at, message.pk))
+        counts = unread[conversation_id]
+        unread_count = Case(
+            *(When(user_id=user_id, then=F('unread_count') + count) for user_id, count in counts.items()),
+            default=F('unread_count'), output_field=PositiveIntegerField(),
+        ) if counts else F('unread_count')
+        InboxEntry.objects.filter(conversation_id=conversation_id).update(
+            last_message=Case(
+                When(last_activity_at__lte=latest.sent_at, then=Value(latest.pk)),
+                default=F('last_message'),
+            ),
+            last_activity_at=Greatest(
+                'last_activity_at', Value(latest.sent_at, output_field=DateTimeField())
+            ),
+            unread_count=unread_count,
+        )
+
+
+def message_deleted(message):
+    """Take a deleted message out of the unread counts and last messages"""
+    entries = InboxEntry.objects.filter(conversation_id=message.conversation_id)
+    entries.exclude(user_id=message.sender_id).filter(
+        Q(last_read_at__isnull=True) | Q(last_read_at__lt=message.sent_at),
+        unread_count__gt=0,
+    ).update(unread_count=F('unread_count') - 1)
+    # Rows that showed it had their last_message set to NULL by the delete
+    entries.filter(last_message__isnull=True).update(
+        last_message=Subquery(latest_message('conversation_id').values('pk')[:1])
+    )
+
+
+def mark_read(user, conversation_id):
+    """Reset a participant's unread count; the number of rows updated"""
+    return InboxEntry.objects.filter(user=user, conversation_id=conversation_id).update(
+        unread_count=0, last_read_at=timezone.now()
+    )
+
+
+def rebuild_inbox(conversation_ids=None):
+    """Recompute the inbox rows of the given conversations (default: all)
+    from their participants and messages; the number of rows kept.
+    """
+    entries = InboxEntry.objects.all()
+    participants = Participant.objects.all()
+    if conversation_ids is not None:
+        entries = entries.filter(conversation_id__in=conversation_ids)
+        participants = participants.filter(conversation_id__in=conversation_ids)
+
+    entries.exclude(Exists(Participant.objects.filter(
+        conversation_id=OuterRef('conversation_id'), user_id=OuterRef('user_id')
+    ))).delete()
+    missing = participants.exclude(Exists(InboxEntry.objects.filter(
+        conversation_id=OuterRef('conversation_id'), user_id=OuterRef('user_id')
+    ))).values_list('conversation_id', 'user_id').order_by('conversation_id')
+    joined = {}
+    for conversation_id, user_id in missing.iterator():
+        joined.setdefault(conversation_id, []).append(user_id)
+    for conversation_id, user_ids in joined.items():
+        add_participants(conversation_id, user_ids)
+
+    latest = latest_message('conversation_id')
+    entries.update(
+        last_message=Subquery(latest.values('pk')[:1]),
+        last_activity_at=Coalesce(Subquery(latest.values('sent_at')[:1]), F('last_activity_at')),
+    )
+    unread = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id')
+    ).exclude(sender_id=OuterRef('user_id')).order_by().values('conversation_id')
+    count = unread.annotate(count=Count('pk')).values('count')
+    entries.filter(last_read_at__isnull=True).update(
+        unread_count=Coalesce(Subquery(count), 0)
+    )
+    entries.filter(last_read_at__isnull=False).update(unread_count=Coalesce(Subquery(
+        unread.filter(sent_at__gt=OuterRef('last_read_at')).annotate(count=Count('pk')).values('count')
+    ), 0))
+    return entries.count()
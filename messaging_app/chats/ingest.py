@@ -0,0 +1,180 @@
+"""Bulk import of messages, for partners loading chat history.
+
+POST /api/messages/bulk/ takes a JSON array or NDJSON of rows
+
+    {"conversation": <uuid>, "sender": <uuid>, "message_body": "...",
+     "sent_at": <ISO 8601, optional>}
+
+Users import their own messages into conversations they take part in;
+staff and users with the chats.import_messages permission may import
+messages from any participant of any conversation.
+
+Rows are validated together: field checks in Python, then membership is
+looked up for all rows in a couple of queries instead of one per row.
+Valid rows are inserted with bulk_create in batches of
+CHATS_BULK_BATCH_SIZE, each in its own transaction. bulk_create sends no
+post_save, so each batch applies its inbox deltas with one UPDATE per
+conversation (inbox.messages_created) and, on commit, publishes one event
+per conversation instead of one per message. Invalid rows are reported by
+index and do not stop the others.
+"""
+
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import inbox
+from .models import Conversation, Message
+from .parsers import MalformedRow
+from .realtime import publish_messages
+
+Participant = Conversation.participants.through
+REQUIRED = ('conversation', 'sender', 'message_body')
+
+
+def max_messages():
+    return getattr(settings, 'CHATS_BULK_MAX_MESSAGES', 10000)
+
+
+def batch_size():
+    return getattr(settings, 'CHATS_BULK_BATCH_SIZE', 500)
+
+
+def chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def clean_row(row):
+    """(fields, errors) for one row, checking its shape and values only"""
+    if isinstance(row, MalformedRow):
+        return None, {'non_field_errors': [row.error]}
+    if not isinstance(row, dict):
+        return None, {'non_field_errors': ['Expected an object.']}
+    errors = {
+        field: ['This field is required.'] for field in REQUIRED if row.get(field) is None
+    }
+    fields = {}
+    for field in ('conversation', 'sender'):
+        if field not in errors:
+            try:
+                fields[field] = uuid.UUID(str(row[field]))
+            except ValueError:
+                errors[field] = ['Must be a valid UUID.']
+    if 'message_body' not in errors:
+        body = row['message_body']
+        if not isinstance(body, str) or not body.strip():
+            errors['message_body'] = ['This field may not be blank.']
+        else:
+            fields['message_body'] = body.strip()
+    if row.get('sent_at') is not None:
+        try:
+            sent_at = parse_datetime(str(row['sent_at']))
+        except ValueError:
+            sent_at = None
+        if sent_at is None:
+            errors['sent_at'] = ['Must be an ISO 8601 datetime.']
+        else:
+            if timezone.is_naive(sent_at):
+                sent_at = timezone.make_aware(sent_at)
+            fields['sent_at'] = sent_at
+    return fields, errors
+
+
+def memberships(conversation_ids):
+    """The existing conversations among the ids, and their (conversation,
+    user) participant pairs.
+    """
+    existing, pairs = set(), set()
+    for ids in chunks(conversation_ids, batch_size()):
+        existing.update(Conversation.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        pairs.update(Participant.objects.filter(
+            conversation_id__in=ids
+        ).values_list('conversation_id', 'user_id'))
+    return existing, pairs
+
+
+def can_import_for_others(user):
+    return user.is_staff or user.has_perm('chats.import_messages')
+
+
+def validate_rows(rows, user):
+    """Validate all rows at once: (valid [(index, fields)], {index: errors})"""
+    cleaned, errors = [], {}
+    for index, row in enumerate(rows):
+        fields, row_errors = clean_row(row)
+        if row_errors:
+            errors[index] = row_errors
+        else:
+            cleaned.append((index, fields))
+
+    existing, pairs = memberships({fields['conversation'] for _, fields in cleaned})
+    importer = can_import_for_others(user)
+    valid = []
+    for index, fields in cleaned:
+        conversation_id = fields['conversation']
+        if conversation_id not in existing or not (
+            importer or (conversation_id, user.pk) in pairs
+        ):
+            # Conversations the user cannot see are reported as missing
+            errors[index] = {'conversation': ['Conversation not found.']}
+        elif not importer and fields['sender'] != user.pk:
+            errors[index] = {'sender': ['You may only import your own messages.']}
+        elif (conversation_id, fields['sender']) not in pairs:
+            errors[index] = {'sender': ['Sender is not a participant of the conversation.']}
+        else:
+            valid.append((index, fields))
+    return valid, errors
+
+
+def stamp_rows(valid):
+    """Give rows without sent_at their own increasing times from now on.
+
+    Message pages are ordered by sent_at alone, so rows sharing one time
+    would be paged by OFFSET in no defined order.
+    """
+    now = timezone.now()
+    unstamped = (fields for _, fields in valid if 'sent_at' not in fields)
+    for step, fields in enumerate(unstamped):
+        fields['sent_at'] = now + timedelta(microseconds=step)
+
+
+def insert_batch(batch):
+    """Insert one batch of validated, stamped rows, with their side effects"""
+    messages = [
+        Message(
+            conversation_id=fields['conversation'], sender_id=fields['sender'],
+            message_body=fields['message_body'], sent_at=fields['sent_at'],
+        )
+        for _, fields in batch
+    ]
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        by_conversation = defaultdict(list)
+        for message in messages:
+            by_conversation[message.conversation_id].append(message)
+        inbox.messages_created(messages)
+        transaction.on_commit(lambda: notify(by_conversation))
+    return messages
+
+
+def notify(by_conversation):
+    for conversation_id, messages in by_conversation.items():
+        messages.sort(key=lambda message: (message.sent_at, message.pk))
+        publish_messages(conversation_id, messages)
+
+
+def ingest(rows, user):
+    """Import rows on behalf of user: (number created, sorted row errors)"""
+    valid, errors = validate_rows(rows, user)
+    stamp_rows(valid)
+    created = 0
+    for batch in chunks(valid, batch_size()):
+        created += len(insert_batch(batch))
+    return created, [{'index': index, 'errors': errors[index]} for index in sorted(errors)]
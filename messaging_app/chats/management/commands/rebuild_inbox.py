@@ -0,0 +1,17 @@
+"""Recompute inbox rows from conversation participants and messages."""
+
+from django.core.management.base import BaseCommand
+
+from chats.inbox import rebuild_inbox
+
+
+class Command(BaseCommand):
+    help = "Recompute every participant's last message and unread count from the messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', action='append', dest='conversations',
+                            help="Only this conversation id (repeatable)")
+
+    def handle(self, *args, **options):
+        total = rebuild_inbox(options['conversations'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} inbox entries."))
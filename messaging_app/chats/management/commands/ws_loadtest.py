@@ -0,0 +1,123 @@
+"""Load test of the real-time endpoint with many idle WebSockets.
+
+Opens --sockets authenticated connections to the chats WebSocket
+application in-process, on a fresh test database, then creates --messages
+messages and times how long each takes to reach every socket. The
+connections are driven through the ASGI protocol directly (see
+asgi_client.py), so the figures cover authentication, the broker and the
+per-connection tasks, not the server's network stack.
+"""
+
+import asyncio
+import resource
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from chats.asgi_client import WebSocketClient
+from chats.models import Conversation, Message, User
+from chats.pubsub import conversation_channel, get_broker
+from chats.realtime import websocket_application
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = round(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = "Hold many idle WebSocket connections and time message fan-out to them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=10)
+        parser.add_argument('--conversations', type=int, default=1,
+                            help="Conversations the sockets are spread over")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Connections opened concurrently")
+        parser.add_argument('--timeout', type=float, default=30,
+                            help="Seconds to wait for a message to reach every socket")
+
+    def handle(self, *args, **options):
+        if options['sockets'] < 1 or options['conversations'] < 1:
+            raise CommandError("--sockets and --conversations must be at least 1")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            sender = User.objects.create_user(
+                username='loadtest', email='loadtest@example.com', password='loadtest'
+            )
+            conversations = []
+            for _ in range(options['conversations']):
+                conversation = Conversation.objects.create()
+                conversation.participants.add(sender)
+                conversations.append(conversation)
+            client = Client()
+            client.force_login(sender)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            asyncio.run(self.run(sender, conversations, cookie, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run(self, sender, conversations, cookie, options):
+        sockets = [
+            WebSocketClient(
+                websocket_application,
+                f'/ws/conversations/{conversations[i % len(conversations)].pk}/',
+                headers=[('Cookie', cookie)],
+            )
+            for i in range(options['sockets'])
+        ]
+
+        # Peak resident memory, in KiB on Linux
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        for start in range(0, len(sockets), options['batch_size']):
+            batch = sockets[start:start + options['batch_size']]
+            accepted = await asyncio.gather(*(socket.connect() for socket in batch))
+            if not all(accepted):
+                raise CommandError("A connection was refused")
+        connect_time = time.perf_counter() - started
+        per_socket = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / len(sockets)
+        self.stdout.write(
+            f"{len(sockets)} sockets connected in {connect_time:.2f}s "
+            f"({len(sockets) / connect_time:.0f}/s), about {per_socket:.1f} KiB each"
+        )
+
+        create = sync_to_async(Message.objects.create)
+        fanouts = []
+        for n in range(options['messages']):
+            conversation = conversations[n % len(conversations)]
+            targets = [
+                socket for socket in sockets if socket.scope['path'].endswith(f'/{conversation.pk}/')
+            ]
+            sent = time.perf_counter()
+            await create(conversation=conversation, sender=sender, message_body=f'load {n}')
+            await asyncio.wait_for(
+                asyncio.gather(*(socket.receive_text() for socket in targets)), options['timeout']
+            )
+            latencies = [socket.received_at - sent for socket in targets]
+            latencies.sort()
+            fanouts.append(latencies[-1])
+            self.stdout.write(
+                f"message {n}: {len(targets)} sockets, p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+                f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+                f"last {latencies[-1] * 1000:.1f} ms"
+            )
+
+        await asyncio.gather(*(socket.disconnect() for socket in sockets))
+        broker = get_broker()
+        if hasattr(broker, 'subscriber_count'):
+            left = sum(broker.subscriber_count(conversation_channel(c.pk)) for c in conversations)
+            if left:
+                raise CommandError(f"{left} subscriptions left after disconnecting")
+        if fanouts:
+            self.stdout.write(self.style.SUCCESS(
+                f"Fan-out to all sockets: median {statistics.median(fanouts) * 1000:.1f} ms, "
+                f"worst {max(fanouts) * 1000:.1f} ms"
+            ))
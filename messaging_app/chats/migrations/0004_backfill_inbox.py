@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+
+def backfill_inbox(apps, schema_editor):
+    Conversation = apps.get_model('chats', 'Conversation')
+    InboxEntry = apps.get_model('chats', 'InboxEntry')
+    Message = apps.get_model('chats', 'Message')
+    Participant = Conversation.participants.through
+
+    # History from before the inbox existed counts as read
+    now = timezone.now()
+    latest = {}
+    messages = Message.objects.values_list('conversation_id', 'message_id', 'sent_at').order_by('sent_at')
+    for conversation_id, message_id, sent_at in messages.iterator(chunk_size=BATCH_SIZE):
+        latest[conversation_id] = (message_id, sent_at)
+
+    InboxEntry.objects.all().delete()
+    entries = []
+    for conversation_id, user_id in Participant.objects.values_list('conversation_id', 'user_id').iterator():
+        message_id, sent_at = latest.get(conversation_id, (None, now))
+        entries.append(InboxEntry(
+            user_id=user_id, conversation_id=conversation_id, last_message_id=message_id,
+            last_activity_at=sent_at, last_read_at=now, unread_count=0,
+        ))
+    InboxEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+def remove_inbox(apps, schema_editor):
+    apps.get_model('chats', 'InboxEntry').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_inboxentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_inbox, remove_inbox),
+    ]
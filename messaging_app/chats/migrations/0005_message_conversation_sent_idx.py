@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_backfill_inbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at'], name='message_conversation_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_alter_message_sent_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'permissions': [('import_messages', 'Can bulk import messages on behalf of any participant')]},
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 # Custom User model
@@ -29,8 +30,43 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     message_body = models.TextField()
-    sent_at = models.DateTimeField(auto_now_add=True)  # Automatically set timestamp
+    # Defaults to now; bulk imports (chats/ingest.py) keep the original time
+    sent_at = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)  # New field to track message creation time
 
+    class Meta:
+        indexes = [
+            # A conversation's history, paged by MessageCursorPagination
+            models.Index(fields=['conversation', 'sent_at'], name='message_conversation_sent_idx'),
+        ]
+        permissions = [
+            ('import_messages', 'Can bulk import messages on behalf of any participant'),
+        ]
+
     def __str__(self):
         return f"{self.sender.username}: {self.message_body[:20]}"
+
+
+# Inbox row of one participant for one conversation
+class InboxEntry(models.Model):
+    """Denormalized inbox state, maintained by chats/inbox.py so the inbox
+    is one indexed read instead of a latest-message lookup and an unread
+    count per conversation.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='inbox_entries')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='inbox_user_conversation_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at'], name='inbox_user_activity_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.conversation}"
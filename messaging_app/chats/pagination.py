@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination
+
+
+class MessageCursorPagination(CursorPagination):
+    """Newest-first pages of a conversation's history.
+
+    The cursor encodes the position of the last message served, so every
+    page is read straight off the ordering column however far back the
+    client scrolls, and messages arriving meanwhile never shift a page.
+    """
+    ordering = '-sent_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class InboxCursorPagination(CursorPagination):
+    """A user's conversations, most recently active first, paged along the
+    (user, last_activity_at) index.
+    """
+    ordering = '-last_activity_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -0,0 +1,38 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class MalformedRow:
+    """An NDJSON line that is not valid JSON, reported as a row error"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class NDJSONParser(BaseParser):
+    """Newline-delimited JSON: one value per line, blank lines skipped.
+
+    Returns the list of values; a line that does not parse becomes a
+    MalformedRow in its place, so the other lines can still be imported.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        rows = []
+        try:
+            for line in stream:
+                line = line.decode(encoding).strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError as exc:
+                    rows.append(MalformedRow(f'Invalid JSON: {exc}'))
+        except UnicodeDecodeError as exc:
+            raise ParseError(f'NDJSON parse error - {exc}')
+        return rows
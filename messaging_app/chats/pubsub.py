@@ -0,0 +1,164 @@
+"""Publish/subscribe used to push new messages to connected clients.
+
+Subscribers are asyncio consumers (WebSocket connections, long polls);
+publishers may be any thread, typically a request thread committing a
+Message. The backend is chosen by CHATS_PUBSUB_BACKEND, a dotted path to
+a Broker subclass:
+
+    subscribe(channel) -> Subscription   (inside a running event loop)
+    publish(channel, message)            (from any thread)
+
+InMemoryBroker, the default, only reaches subscribers of the same process,
+which is enough for a single ASGI worker, for development and for tests.
+Several workers need a backend that relays publishes between processes
+(e.g. over Redis pub/sub) behind the same two calls.
+"""
+
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Overflow(Exception):
+    """The subscriber fell too far behind and was dropped"""
+
+
+class Subscription:
+    """Messages published on one channel, in order, for one consumer"""
+
+    def __init__(self, broker, channel, max_pending):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.max_pending = max_pending
+        self.overflowed = False
+        self.closed = False
+
+    def deliver(self, message):
+        # Runs on self.loop
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.max_pending:
+            self.overflowed = True
+            self.close()
+        else:
+            self.queue.put_nowait(message)
+
+    async def get(self):
+        """The next message, or None once closed (Overflow if it was
+        closed for falling behind)
+        """
+        message = await self.queue.get()
+        if message is None and self.overflowed:
+            raise Overflow(self.channel)
+        return message
+
+    def drain(self):
+        """Messages already delivered, without waiting"""
+        messages = []
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def close(self):
+        """Unsubscribe and wake a pending get(); call on self.loop"""
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+            self.queue.put_nowait(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Broker:
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+
+class InMemoryBroker(Broker):
+    """Fan-out between the event loops of this process.
+
+    Subscribers are grouped by event loop, so a publish costs one
+    call_soon_threadsafe per loop rather than one per subscriber.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}  # channel -> {loop: set of subscriptions}
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'CHATS_PUBSUB_MAX_PENDING', 100)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_pending)
+        with self._lock:
+            loops = self._channels.setdefault(channel, {})
+            loops.setdefault(subscription.loop, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            loops = self._channels.get(subscription.channel, {})
+            subscriptions = loops.get(subscription.loop, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                loops.pop(subscription.loop, None)
+            if not loops:
+                self._channels.pop(subscription.channel, None)
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return sum(map(len, self._channels.get(channel, {}).values()))
+
+    def publish(self, channel, message):
+        with self._lock:
+            targets = [
+                (loop, list(subscriptions))
+                for loop, subscriptions in self._channels.get(channel, {}).items()
+            ]
+        for loop, subscriptions in targets:
+            try:
+                loop.call_soon_threadsafe(deliver_all, subscriptions, message)
+            except RuntimeError:
+                # The loop was closed without its subscribers unsubscribing
+                for subscription in subscriptions:
+                    self.unsubscribe(subscription)
+
+
+def deliver_all(subscriptions, message):
+    for subscription in subscriptions:
+        subscription.deliver(message)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker configured by CHATS_PUBSUB_BACKEND"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, 'CHATS_PUBSUB_BACKEND', 'chats.pubsub.InMemoryBroker')
+            _broker = import_string(path)()
+        return _broker
+
+
+def conversation_channel(conversation_id):
+    return f'conversation:{conversation_id}'
@@ -0,0 +1,228 @@
+"""Real-time delivery of new messages to conversation participants.
+
+New Message rows are rendered once, on commit, and published on their
+conversation's channel (see pubsub.py). Clients receive them over
+
+    ws://<host>/ws/conversations/<conversation_id>/
+
+served by websocket_application, which messaging_app/asgi.py routes
+WebSocket connections to, or, where WebSockets are unavailable, by long
+polling
+
+    GET /api/conversations/<conversation_id>/poll/?after=<message_id>&timeout=25
+
+which answers as soon as there are messages after the given one, or with
+an empty list when the timeout runs out. Both authenticate with the Django
+session cookie and only admit participants of the conversation.
+"""
+
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import JsonResponse, parse_cookie
+from django.http.request import split_domain_port, validate_host
+from django.utils.dateparse import parse_datetime
+
+from .models import Conversation, Message
+from .pubsub import Overflow, conversation_channel, get_broker
+from .serializers import MessageSerializer
+
+CONVERSATION_PATH = re.compile(r'^/ws/conversations/(?P<conversation_id>[0-9a-f-]{36})/$')
+
+# WebSocket close codes
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def render_message(message):
+    return json.dumps(
+        {'type': 'message', 'message': MessageSerializer(message).data}, cls=DjangoJSONEncoder
+    )
+
+
+def publish_message(message):
+    get_broker().publish(conversation_channel(message.conversation_id), render_message(message))
+
+
+def publish_messages(conversation_id, messages):
+    """Publish many messages of one conversation as a single event"""
+    get_broker().publish(conversation_channel(conversation_id), json.dumps(
+        {'type': 'messages', 'messages': MessageSerializer(messages, many=True).data},
+        cls=DjangoJSONEncoder
+    ))
+
+
+def event_messages(text):
+    """The serialized messages carried by a published event"""
+    event = json.loads(text)
+    return event['messages'] if event['type'] == 'messages' else [event['message']]
+
+
+def is_participant(user, conversation_id):
+    return (
+        user is not None and user.is_authenticated
+        and Conversation.objects.filter(pk=conversation_id, participants=user).exists()
+    )
+
+
+def allowed_hosts():
+    hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not hosts:
+        hosts = ['.localhost', '127.0.0.1', '[::1]']
+    return hosts
+
+
+def header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def scope_user(scope):
+    """The user of the session cookie sent with a WebSocket handshake"""
+    cookies = parse_cookie(header(scope, b'cookie') or '')
+    session_store = import_module(settings.SESSION_ENGINE).SessionStore
+    request = SimpleNamespace(
+        session=session_store(cookies.get(settings.SESSION_COOKIE_NAME))
+    )
+    return auth.get_user(request)
+
+
+def origin_allowed(scope):
+    # Browsers send the session cookie with cross-site WebSocket handshakes,
+    # so, like CSRF protection, only same-site origins are accepted
+    origin = header(scope, b'origin')
+    if origin is None:
+        return True
+    host = origin.split('://', 1)[-1]
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, allowed_hosts())
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application pushing a conversation's new messages to a socket"""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = CONVERSATION_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    conversation_id = match['conversation_id']
+
+    allowed = origin_allowed(scope) and await sync_to_async(
+        lambda: is_participant(scope_user(scope), conversation_id)
+    )()
+    if not allowed:
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    # Subscribe before accepting so nothing committed after the client
+    # sees the handshake is missed
+    with get_broker().subscribe(conversation_channel(conversation_id)) as subscription:
+        await send({'type': 'websocket.accept'})
+        await forward(subscription, receive, send)
+
+
+async def forward(subscription, receive, send):
+    """Send published messages until the client disconnects"""
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    disconnected.add_done_callback(lambda _: subscription.close())
+    try:
+        while (text := await subscription.get()) is not None:
+            await send({'type': 'websocket.send', 'text': text})
+    except Overflow:
+        # Too far behind: the client reconnects and catches up from the
+        # paginated history
+        await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+    finally:
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    # Frames sent by the client are ignored; messages are posted over HTTP
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass
+
+
+def merge_messages(*lists):
+    """Serialized messages of several lists, each once, oldest first"""
+    # Ids are UUIDs when read here and strings when published
+    unique = {str(message['message_id']): message for messages in lists for message in messages}
+    return sorted(
+        unique.values(),
+        key=lambda message: (parse_datetime(message['sent_at']), str(message['message_id']))
+    )
+
+
+def messages_after(conversation_id, message_id, limit):
+    """Serialized messages of a conversation sent after the given one,
+    oldest first (Message.DoesNotExist if it is not in the conversation).
+    """
+    anchor = Message.objects.only('sent_at').get(pk=message_id, conversation_id=conversation_id)
+    messages = Message.objects.filter(conversation_id=conversation_id).filter(
+        Q(sent_at__gt=anchor.sent_at) | Q(sent_at=anchor.sent_at, pk__gt=anchor.pk)
+    ).order_by('sent_at', 'pk')[:limit]
+    return MessageSerializer(messages, many=True).data
+
+
+async def poll_messages(request, conversation_pk):
+    """Long-polling fallback for clients without WebSockets"""
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return JsonResponse({'detail': 'Authentication required.'}, status=401)
+    if not await sync_to_async(is_participant)(user, conversation_pk):
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    after = request.GET.get('after')
+    limit = getattr(settings, 'CHATS_LONG_POLL_LIMIT', 100)
+    try:
+        timeout = min(
+            float(request.GET.get('timeout', 25)), getattr(settings, 'CHATS_LONG_POLL_TIMEOUT', 30)
+        )
+    except ValueError:
+        return JsonResponse({'detail': 'timeout must be a number of seconds.'}, status=400)
+    fetch = sync_to_async(messages_after)
+
+    with get_broker().subscribe(conversation_channel(conversation_pk)) as subscription:
+        # Subscribed first, so a message committed between this read and
+        # the wait still wakes the poll
+        try:
+            messages = await fetch(conversation_pk, after, limit) if after else []
+        except (Message.DoesNotExist, ValidationError):
+            return JsonResponse({'detail': 'after must be a message of this conversation.'},
+                                status=400)
+        if not messages:
+            try:
+                published = [await asyncio.wait_for(subscription.get(), max(timeout, 0))]
+            except (asyncio.TimeoutError, Overflow):
+                published = []
+            published = [
+                message for text in published + subscription.drain() if text
+                for message in event_messages(text)
+            ]
+            if after and published:
+                # sent_at is stamped before commit, so a message committed
+                # late can sort before the client's anchor and escape the
+                # re-read; its publish still carries it
+                messages = merge_messages(published, await fetch(conversation_pk, after, limit))
+            else:
+                messages = published
+            messages = messages[:limit]
+
+    return JsonResponse({
+        'results': messages,
+        'after': str(messages[-1]['message_id']) if messages else after,
+    })
@@ -1,5 +1,11 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import User, Conversation, Message
+from .models import User, Conversation, Message, InboxEntry
+
+
+def latest_messages_count():
+    """Number of recent messages embedded in each conversation"""
+    return getattr(settings, 'CHATS_LATEST_MESSAGES', 10)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,20 +18,41 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ['message_id', 'conversation', 'sender', 'message_body', 'sent_at', 'created_at']
+        # Set from the URL and the authenticated user by MessageViewSet
+        read_only_fields = ['conversation', 'sender', 'sent_at']
 
 class ConversationSerializer(serializers.ModelSerializer):
-    messages = serializers.SerializerMethodField()  # nested messages field
+    # Only the newest messages are embedded; the full history is paginated
+    # at /conversations/{conversation_pk}/messages/
+    latest_messages = serializers.SerializerMethodField()
+    message_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
-        fields = ['conversation_id', 'participants', 'messages']
+        fields = ['conversation_id', 'participants', 'message_count', 'latest_messages']
 
-    def get_messages(self, obj):
-        messages = obj.messages.all()
+    def get_latest_messages(self, obj):
+        # Use the prefetch from ConversationViewSet.get_queryset when present
+        messages = getattr(obj, 'latest_messages', None)
+        if messages is None:
+            messages = obj.messages.order_by('-sent_at')[:latest_messages_count()]
         return MessageSerializer(messages, many=True).data
 
+    def get_message_count(self, obj):
+        if hasattr(obj, 'message_count'):
+            return obj.message_count
+        return obj.messages.count()
+
     def validate(self, data):
         # Example validation raising ValidationError
         if not data.get('participants'):
             raise serializers.ValidationError("At least one participant required")
         return data
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    last_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = InboxEntry
+        fields = ['conversation', 'last_message', 'last_activity_at', 'last_read_at', 'unread_count']
+        read_only_fields = fields
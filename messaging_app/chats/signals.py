@@ -0,0 +1,48 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from . import inbox
+from .models import Conversation, InboxEntry, Message
+from .realtime import publish_message
+
+
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, raw=False, **kwargs):
+    # Only committed messages are pushed, so clients never see a message
+    # that is later rolled back
+    if created and not raw:
+        transaction.on_commit(lambda: publish_message(instance))
+
+
+@receiver(post_save, sender=Message)
+def update_inbox_on_message(sender, instance, created, raw=False, **kwargs):
+    # Same transaction as the message, so the inbox commits or rolls back
+    # with it
+    if created and not raw:
+        inbox.message_created(instance)
+
+
+@receiver(post_delete, sender=Message)
+def update_inbox_on_message_delete(sender, instance, **kwargs):
+    inbox.message_deleted(instance)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def update_inbox_on_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse: changed from the user's side, user.conversations.add(...)
+    if action == 'post_add':
+        if reverse:
+            for conversation_id in pk_set:
+                inbox.add_participants(conversation_id, [instance.pk])
+        else:
+            inbox.add_participants(instance.pk, pk_set)
+    elif action == 'post_remove':
+        if reverse:
+            InboxEntry.objects.filter(user=instance, conversation_id__in=pk_set).delete()
+        else:
+            InboxEntry.objects.filter(conversation=instance, user_id__in=pk_set).delete()
+    elif action == 'post_clear':
+        if reverse:
+            InboxEntry.objects.filter(user=instance).delete()
+        else:
+            InboxEntry.objects.filter(conversation=instance).delete()
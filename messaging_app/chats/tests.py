@@ -1,3 +1,412 @@
-from django.test import TestCase
+import asyncio
+import json
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .asgi_client import WebSocketClient
+from .inbox import rebuild_inbox
+from .models import Conversation, InboxEntry, Message, User
+from .pubsub import conversation_channel, get_broker
+from .realtime import CLOSE_FORBIDDEN, websocket_application
+
+
+def make_user(username, **extra):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='pass', **extra
+    )
+
+
+def make_conversation(*participants, messages=0):
+    """A conversation whose messages were sent a minute apart, oldest first"""
+    conversation = Conversation.objects.create()
+    conversation.participants.set(participants)
+    start = timezone.now() - timedelta(days=1)
+    for i in range(messages):
+        message = Message.objects.create(
+            conversation=conversation, sender=participants[i % len(participants)],
+            message_body=f'message {i}'
+        )
+        Message.objects.filter(pk=message.pk).update(sent_at=start + timedelta(minutes=i))
+    return conversation
+
+
+@override_settings(CHATS_LATEST_MESSAGES=5)
+class ConversationListTests(TestCase):
+    """Conversations embed only their latest messages, in fixed queries"""
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+
+    def test_embeds_latest_messages_and_count(self):
+        for _ in range(3):
+            make_conversation(self.alice, self.bob, messages=12)
+        make_conversation(self.alice)
+
+        # Conversations, participants, latest messages
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('conversations-list'))
+        self.assertEqual(response.status_code, 200)
+        counts = sorted(item['message_count'] for item in response.data)
+        self.assertEqual(counts, [0, 12, 12, 12])
+        for item in response.data:
+            bodies = [message['message_body'] for message in item['latest_messages']]
+            if item['message_count']:
+                self.assertEqual(bodies, [f'message {i}' for i in range(11, 6, -1)])
+            else:
+                self.assertEqual(bodies, [])
+
+
+class MessageHistoryTests(TestCase):
+    """The nested messages route pages through one conversation's history"""
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = make_conversation(self.alice, self.bob, messages=20)
+        make_conversation(self.alice, messages=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = reverse('conversation-messages-list', kwargs={
+            'conversation_pk': self.conversation.pk
+        })
+
+    def test_cursor_pages_cover_history_newest_first(self):
+        bodies = []
+        response = self.client.get(self.url, {'page_size': 7})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            bodies += [message['message_body'] for message in response.data['results']]
+            if not response.data['next']:
+                break
+            # Membership check, page
+            with self.assertNumQueries(2):
+                response = self.client.get(response.data['next'])
+        self.assertEqual(bodies, [f'message {i}' for i in range(19, -1, -1)])
+
+    def test_pages_are_read_from_the_conversation_index(self):
+        plan = Message.objects.filter(
+            conversation=self.conversation
+        ).order_by('-sent_at')[:50].explain()
+        self.assertIn('message_conversation_sent_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_only_participants_see_and_post(self):
+        response = self.client.post(self.url, {'message_body': 'hi'})
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(pk=response.data['message_id'])
+        self.assertEqual((message.conversation, message.sender), (self.conversation, self.alice))
+
+        self.client.force_authenticate(make_user('mallory'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.post(self.url, {'message_body': 'hi'}).status_code, 404)
+        invalid = reverse('conversation-messages-list', kwargs={'conversation_pk': 'nope'})
+        self.assertEqual(self.client.get(invalid).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class InboxTests(TestCase):
+    """Inbox rows follow messages, reads and participant changes"""
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.carol = make_user('carol')
+        self.with_bob = make_conversation(self.alice, self.bob)
+        self.with_carol = make_conversation(self.alice, self.carol)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, conversation, sender, body):
+        return Message.objects.create(conversation=conversation, sender=sender, message_body=body)
+
+    def inbox(self, user):
+        return {
+            entry.conversation_id: (entry.last_message.message_body if entry.last_message else None,
+                                    entry.unread_count)
+            for entry in InboxEntry.objects.filter(user=user).select_related('last_message')
+        }
+
+    def test_inbox_follows_messages_and_reads(self):
+        self.send(self.with_bob, self.bob, 'a')
+        self.send(self.with_bob, self.bob, 'b')
+        self.send(self.with_carol, self.carol, 'c')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('inbox-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['conversation'], item['last_message']['message_body'], item['unread_count'])
+             for item in response.data['results']],
+            [(self.with_carol.pk, 'c', 1), (self.with_bob.pk, 'b', 2)]
+        )
+
+        response = self.client.post(reverse('conversations-read', args=[self.with_bob.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unread_count'], 0)
+        for pk in ('abc', uuid.uuid4()):
+            response = self.client.post(reverse('conversations-read', args=[pk]))
+            self.assertEqual(response.status_code, 404)
+
+        # Replying reads the conversation and brings it to the top
+        reply = self.send(self.with_bob, self.alice, 'd')
+        response = self.client.get(reverse('inbox-list'))
+        self.assertEqual(response.data['results'][0]['conversation'], self.with_bob.pk)
+        self.assertEqual(self.inbox(self.alice)[self.with_bob.pk], ('d', 0))
+        self.assertEqual(self.inbox(self.bob), {self.with_bob.pk: ('d', 1)})
+
+        reply.delete()
+        self.assertEqual(self.inbox(self.bob), {self.with_bob.pk: ('b', 0)})
+        self.assertEqual(self.inbox(self.alice)[self.with_bob.pk], ('b', 0))
+
+    def test_participant_changes_and_rebuild(self):
+        self.send(self.with_bob, self.bob, 'a')
+        self.with_bob.participants.add(self.carol)
+        self.assertEqual(self.inbox(self.carol)[self.with_bob.pk], ('a', 0))
+        self.bob.conversations.remove(self.with_bob)
+        self.assertEqual(self.inbox(self.bob), {})
+
+        expected = {user: self.inbox(user) for user in (self.alice, self.carol)}
+        InboxEntry.objects.filter(user=self.carol).delete()
+        InboxEntry.objects.update(unread_count=7, last_message=None)
+        InboxEntry.objects.create(user=self.bob, conversation=self.with_carol)
+        self.assertEqual(rebuild_inbox(), 4)
+        self.assertEqual(self.inbox(self.bob), {})
+        self.assertEqual(self.inbox(self.alice), expected[self.alice])
+        self.assertEqual(self.inbox(self.carol), expected[self.carol])
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('inbox-list')).status_code, 403)
+
+
+
+@override_settings(CHATS_BULK_BATCH_SIZE=500)
+class BulkIngestTests(TestCase):
+    """Bulk imports insert valid rows in batches and report the others"""
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.carol = make_user('carol')
+        self.conversation = make_conversation(self.alice, self.bob)
+        self.other = make_conversation(self.bob, self.carol)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = reverse('messages-bulk')
+
+    def row(self, body, sender=None, **extra):
+        return {
+            'conversation': str(self.conversation.pk),
+            'sender': str((sender or self.alice).pk), 'message_body': body, **extra,
+        }
+
+    def test_ndjson_reports_row_errors_and_imports_the_rest(self):
+        lines = [
+            json.dumps(self.row('first', sent_at='2024-01-01T10:00:00Z')),
+            '{not json',
+            json.dumps(self.row('second', sent_at='2024-01-01T10:05:00Z')),
+            json.dumps(self.row('posing as bob', sender=self.bob)),
+            json.dumps({**self.row('elsewhere'), 'conversation': str(self.other.pk)}),
+            json.dumps(self.row('   ')),
+            json.dumps({'sender': 'nope', 'message_body': 'x'}),
+        ]
+        with mock.patch('chats.ingest.publish_messages') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    self.url, '\n'.join(lines), content_type='application/x-ndjson'
+                )
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [(error['index'], sorted(error['errors'])) for error in response.data['errors']],
+            [(1, ['non_field_errors']), (3, ['sender']), (4, ['conversation']),
+             (5, ['message_body']), (6, ['conversation', 'sender'])]
+        )
+
+        history = Message.objects.filter(conversation=self.conversation).order_by('sent_at')
+        self.assertEqual([message.message_body for message in history], ['first', 'second'])
+        self.assertEqual(history[0].sent_at.isoformat(), '2024-01-01T10:00:00+00:00')
+
+        # One event for the conversation, not one per message
+        publish.assert_called_once()
+        conversation_id, messages = publish.call_args.args
+        self.assertEqual(conversation_id, self.conversation.pk)
+        self.assertEqual([message.message_body for message in messages], ['first', 'second'])
+
+    def test_importers_may_post_as_any_participant(self):
+        rows = [self.row('from bob', sender=self.bob), self.row('from carol', sender=self.carol)]
+        self.alice.user_permissions.add(Permission.objects.get(codename='import_messages'))
+        self.client.force_authenticate(User.objects.get(pk=self.alice.pk))
+        response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['errors'], [
+            {'index': 1, 'errors': {'sender': ['Sender is not a participant of the conversation.']}}
+        ])
+        self.assertEqual(Message.objects.get().sender, self.bob)
+
+    def test_large_array_is_inserted_in_batches(self):
+        self.client.force_authenticate(make_user('importer', is_staff=True))
+        rows = [self.row(f'message {i}', sender=[self.alice, self.bob][i % 2]) for i in range(1200)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 1200, 'errors': []})
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 1200)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "chats_message"')]
+        # A few multi-row INSERTs per batch (SQLite caps the parameters of
+        # each), not one per message
+        self.assertLess(len(inserts), 12)
+        self.assertLess(len(queries), 60)
+
+        # The per-batch deltas agree with a recount from the messages
+        inbox = list(InboxEntry.objects.order_by('pk').values())
+        self.assertEqual(inbox[0]['unread_count'] + inbox[1]['unread_count'], 1200)
+        rebuild_inbox()
+        self.assertEqual(list(InboxEntry.objects.order_by('pk').values()), inbox)
+
+    @override_settings(CHATS_BULK_BATCH_SIZE=40)
+    def test_unstamped_rows_page_in_import_order(self):
+        rows = [self.row(f'message {i}') for i in range(120)]
+        self.assertEqual(self.client.post(self.url, rows, format='json').status_code, 201)
+        # No ties for the pages to break by OFFSET
+        self.assertEqual(len(set(Message.objects.values_list('sent_at', flat=True))), 120)
+
+        url = reverse('conversation-messages-list', kwargs={'conversation_pk': self.conversation.pk})
+        bodies = []
+        response = self.client.get(url, {'page_size': 50})
+        while True:
+            bodies += [message['message_body'] for message in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(bodies, [f'message {i}' for i in range(119, -1, -1)])
+
+    def test_rejects_outsiders_and_oversized_requests(self):
+        self.client.force_authenticate(self.carol)
+        response = self.client.post(self.url, [self.row('hi')], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(response.data['errors'][0]['errors'], {'conversation': ['Conversation not found.']})
+
+        with override_settings(CHATS_BULK_MAX_MESSAGES=2):
+            response = self.client.post(self.url, [self.row('hi')] * 3, format='json')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.client.post(self.url, {'a': 1}, format='json').status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+
+def session_cookie(user):
+    client = Client()
+    client.force_login(user)
+    return f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+
+class RealtimeTests(TransactionTestCase):
+    """New messages reach participants over WebSockets and long polls"""
+
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.mallory = make_user('mallory')
+        self.conversation = make_conversation(self.alice, self.bob, messages=2)
+        self.path = f'/ws/conversations/{self.conversation.pk}/'
+        self.channel = conversation_channel(self.conversation.pk)
+
+    def socket(self, user, origin='https://chat.example.com'):
+        return WebSocketClient(
+            websocket_application, self.path,
+            headers=[('Cookie', session_cookie(user)), ('Origin', origin)]
+        )
+
+    def send_message(self, body):
+        return sync_to_async(Message.objects.create)(
+            conversation=self.conversation, sender=self.bob, message_body=body
+        )
+
+    @override_settings(ALLOWED_HOSTS=['chat.example.com'])
+    def test_websocket_pushes_to_participants_only(self):
+        alice, outsider = self.socket(self.alice), self.socket(self.mallory)
+        cross_site = self.socket(self.alice, origin='https://evil.example.org')
+
+        async def scenario():
+            for socket in (outsider, cross_site):
+                self.assertFalse(await socket.connect())
+                self.assertEqual(socket.close_code, CLOSE_FORBIDDEN)
+            self.assertTrue(await alice.connect())
+
+            await self.send_message('hello')
+            event = json.loads(await alice.receive_text(timeout=5))
+            self.assertEqual(event['type'], 'message')
+            self.assertEqual(event['message']['message_body'], 'hello')
+
+            await alice.disconnect()
+            self.assertEqual(get_broker().subscriber_count(self.channel), 0)
+
+        async_to_sync(scenario)()
+
+    def test_long_poll_returns_new_messages(self):
+        client = AsyncClient()
+        client.force_login(self.alice)
+        url = reverse('conversation-poll', args=[self.conversation.pk])
+        first = Message.objects.filter(message_body='message 0').get()
+
+        async def scenario():
+            response = await client.get(url, {'after': str(first.pk)})
+            self.assertEqual(
+                [message['message_body'] for message in response.json()['results']],
+                ['message 1']
+            )
+            after = response.json()['after']
+
+            response = await client.get(url, {'after': after, 'timeout': 0.05})
+            self.assertEqual(response.json(), {'results': [], 'after': after})
+
+            poll = asyncio.ensure_future(client.get(url, {'after': after, 'timeout': 5}))
+            while not get_broker().subscriber_count(self.channel):
+                await asyncio.sleep(0.01)
+            await self.send_message('late')
+            response = await poll
+            self.assertEqual(response.json()['results'][0]['message_body'], 'late')
+
+        async_to_sync(scenario)()
+
+        outsider = Client()
+        outsider.force_login(self.mallory)
+        self.assertEqual(outsider.get(url).status_code, 404)
+        self.assertEqual(Client().get(url).status_code, 401)
+
+    def test_long_poll_returns_message_committed_after_a_newer_one(self):
+        client = AsyncClient()
+        client.force_login(self.alice)
+        url = reverse('conversation-poll', args=[self.conversation.pk])
+        newest = Message.objects.order_by('-sent_at').first()
+
+        async def scenario():
+            poll = asyncio.ensure_future(client.get(url, {'after': str(newest.pk), 'timeout': 5}))
+            while not get_broker().subscriber_count(self.channel):
+                await asyncio.sleep(0.01)
+            # Stamped before the message the client holds, committed after it
+            await sync_to_async(Message.objects.create)(
+                conversation=self.conversation, sender=self.bob, message_body='slow commit',
+                sent_at=newest.sent_at - timedelta(seconds=1),
+            )
+            response = (await poll).json()
+            self.assertEqual(
+                [message['message_body'] for message in response['results']], ['slow commit']
+            )
+            self.assertEqual(response['after'], response['results'][-1]['message_id'])
+
+        async_to_sync(scenario)()
@@ -1,14 +1,18 @@
 from django.urls import path, include
-from rest_framework_nested.routers import NestedDefaultRouter
-from .views import ConversationViewSet, MessageViewSet
+from rest_framework_nested import routers
+from .views import BulkMessageView, ConversationViewSet, InboxViewSet, MessageViewSet
+from .realtime import poll_messages
 
-router = NestedDefaultRouter()
+router = routers.DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversations')
+router.register(r'inbox', InboxViewSet, basename='inbox')
 
-message_router = NestedDefaultRouter(router, r'conversations', lookup='conversation')
+message_router = routers.NestedDefaultRouter(router, r'conversations', lookup='conversation')
 message_router.register(r'messages', MessageViewSet, basename='conversation-messages')
 
 urlpatterns = [
+    path('messages/bulk/', BulkMessageView.as_view(), name='messages-bulk'),
+    path('conversations/<uuid:conversation_pk>/poll/', poll_messages, name='conversation-poll'),
     path('', include(router.urls)),
     path('', include(message_router.urls)),
 ]
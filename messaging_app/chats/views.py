@@ -1,17 +1,127 @@
 from django.shortcuts import render
 
 # Create your views here.
-from rest_framework import viewsets
-from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from django.core.exceptions import ValidationError
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import JSONParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import inbox
+from .ingest import ingest, max_messages
+from .models import Conversation, InboxEntry, Message
+from .pagination import InboxCursorPagination, MessageCursorPagination
+from .parsers import NDJSONParser
+from .serializers import (
+    ConversationSerializer, InboxEntrySerializer, MessageSerializer, latest_messages_count,
+)
+
+
+def conversation_queryset():
+    """Conversations with their participants, message count and latest
+    messages loaded in a fixed number of queries, whatever their length.
+    """
+    # The prefetch is sliced per conversation with a window function, so
+    # only the latest messages are read; the count is a correlated
+    # subquery rather than a JOIN + GROUP BY over every message
+    message_count = Message.objects.filter(
+        conversation=OuterRef('pk')
+    ).order_by().values('conversation').annotate(count=Count('pk')).values('count')
+    latest = Message.objects.order_by('-sent_at')[:latest_messages_count()]
+    return Conversation.objects.prefetch_related(
+        'participants',
+        Prefetch('messages', queryset=latest, to_attr='latest_messages'),
+    ).annotate(
+        message_count=Coalesce(Subquery(message_count), 0)
+    )
 
 class ConversationViewSet(viewsets.ModelViewSet):
-    queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
 
+    def get_queryset(self):
+        return conversation_queryset()
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def read(self, request, pk=None):
+        """Mark the conversation read up to now for the current user"""
+        try:
+            marked = inbox.mark_read(request.user, pk)
+        except ValidationError:  # not a UUID
+            marked = False
+        if not marked:
+            raise NotFound()
+        entry = InboxEntry.objects.select_related('last_message').get(
+            user=request.user, conversation_id=pk
+        )
+        return Response(InboxEntrySerializer(entry).data)
+
 class MessageViewSet(viewsets.ModelViewSet):
-    queryset = Message.objects.all()
+    """The history of one conversation, newest first, served from the nested
+    /conversations/{conversation_pk}/messages/ route to its participants.
+    """
     serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Checked once per request rather than joined into every page query,
+        # which then reads straight off the (conversation, sent_at) index
+        try:
+            is_participant = Conversation.objects.filter(
+                pk=self.kwargs['conversation_pk'], participants=request.user
+            ).exists()
+        except ValidationError:  # not a UUID
+            is_participant = False
+        if not is_participant:
+            raise NotFound()
+
+    def get_queryset(self):
+        return Message.objects.filter(conversation_id=self.kwargs['conversation_pk'])
+
+    def perform_create(self, serializer):
+        serializer.save(conversation_id=self.kwargs['conversation_pk'], sender=self.request.user)
+
+class InboxViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """The current user's conversations with their last message and unread
+    count, read from the InboxEntry rows maintained by chats/inbox.py.
+    """
+    serializer_class = InboxEntrySerializer
+    pagination_class = InboxCursorPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return InboxEntry.objects.filter(user=self.request.user).select_related('last_message')
+
+class BulkMessageView(APIView):
+    """Import many messages in one request, as a JSON array or NDJSON.
+
+    201 when every row was created, 207 when only some were, 400 when none
+    were; the body counts the created rows and lists the errors by row.
+    """
+    parser_classes = [JSONParser, NDJSONParser]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'detail': 'Expected a JSON array or NDJSON of messages.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > max_messages():
+            return Response({'detail': f'At most {max_messages()} messages per request.'},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        created, errors = ingest(rows, request.user)
+        if not errors:
+            code = status.HTTP_201_CREATED
+        elif created:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({'created': created, 'errors': errors}, status=code)
+
 from django.views.decorators.cache import cache_page
 
 # Assuming you have a view like this:
@@ -137,3 +137,18 @@ CACHES = {
     }
 }
 STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# Messages embedded in each conversation of GET /api/conversations/; the
+# full history is paginated at /api/conversations/<id>/messages/
+CHATS_LATEST_MESSAGES = 10
+
+# Real-time delivery (chats/realtime.py). The in-memory broker reaches the
+# sockets of a single ASGI worker; several workers need a shared backend.
+ASGI_APPLICATION = 'messaging_app.asgi.application'
+CHATS_PUBSUB_BACKEND = 'chats.pubsub.InMemoryBroker'
+CHATS_PUBSUB_MAX_PENDING = 100
+CHATS_LONG_POLL_TIMEOUT = 30
+
+# Bulk message import (chats/ingest.py): rows per request, rows per INSERT
+CHATS_BULK_MAX_MESSAGES = 10000
+CHATS_BULK_BATCH_SIZE = 500